@@ -102,11 +102,11 @@ class Buffer(collections.MutableSet):
             actrvariables = {}
         elem = self._data.pop()
         try:
-            mod_attr_val = {x[0]: utilities.check_bound_vars(actrvariables, x[1]) for x in otherchunk.removeunused()} #creates dict of attr-val pairs according to otherchunk
+            mod_attr_val = chunks.Template.compile(otherchunk).fill(actrvariables) #creates dict of attr-val pairs according to otherchunk
         except utilities.ACTRError as arg:
             raise utilities.ACTRError("The modification by the chunk '%s is impossible; %s" % (otherchunk, arg))
-        elem_attr_val = {x[0]: x[1] for x in elem}
+        elem_attr_val = dict(elem)
         elem_attr_val.update(mod_attr_val) #updates original chunk with attr-val from otherchunk
-        mod_chunk = chunks.Chunk(otherchunk.typename, **elem_attr_val) #creates new chunk
+        mod_chunk = chunks.Chunk.build(otherchunk.typename, elem_attr_val) #creates new chunk
 
         self._data.add(mod_chunk) #put chunk directly into buffer
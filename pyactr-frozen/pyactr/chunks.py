@@ -7,6 +7,7 @@ import re
 import random
 import warnings
 import numbers
+import weakref
 
 import pyactr.utilities as utilities
 from pyactr.utilities import ACTRError
@@ -41,11 +42,15 @@ class Chunk(collections.Sequence):
     """
     ACT-R chunks. Based on namedtuple (tuple with dictionary-like properties).
 
+    Chunks without variables are immutable and interned: structurally identical chunks are one instance, with a precomputed hash. Chunks with variables are created as PatternChunk.
+
     For example:
     >>> Chunk('chunktype_example0', value='one')
     chunktype_example0(value= one)
     """
 
+    __slots__ = ("typename", "actrchunk", "_boundvars", "__empty", "__unused", "__hash", "__weakref__")
+
     class EmptyValue(object):
         """
         Empty values used in chunks. These are None values.
@@ -69,15 +74,14 @@ class Chunk(collections.Sequence):
     _chunktypes = {}
     _undefinedchunktypecounter = 0
     _chunks = {}
+    _interned = weakref.WeakValueDictionary() #structural keys -> chunks without variables
 
     __emptyvalue = EmptyValue()
+    __nonevalue = utilities.VarvalClass(values=str(utilities.EMPTYVALUE), variables=None, negvalues=(), negvariables=())
 
     _similarities = {} #dict of similarities between chunks
 
-    def __init__(self, typename, **dictionary):
-        self.typename = typename
-        self.boundvars = {} #dict of bound variables
-
+    def __new__(cls, typename, **dictionary):
         kwargs = {}
         for key in dictionary:
 
@@ -87,7 +91,7 @@ class Chunk(collections.Sequence):
 
             elif isinstance(dictionary[key], utilities.VarvalClass):
                 for x in dictionary[key]._fields:
-                    if x in {"values", "variables"} and not isinstance(getattr(dictionary[key], x), str) and getattr(dictionary[key], x) != self.__emptyvalue and not isinstance(getattr(dictionary[key], x), Chunk):
+                    if x in {"values", "variables"} and not isinstance(getattr(dictionary[key], x), str) and getattr(dictionary[key], x) != Chunk.__emptyvalue and not isinstance(getattr(dictionary[key], x), Chunk):
                         raise TypeError("Values and variables must be strings, chunks or empty (None)")
 
                     elif x in {"negvariables", "negvalues"} and (not isinstance(getattr(dictionary[key], x), collections.abc.Sequence) or isinstance(getattr(dictionary[key], x), collections.abc.MutableSequence)):
@@ -117,14 +121,14 @@ class Chunk(collections.Sequence):
             #adding _ to minimize/avoid name clashes
             kwargs[key+"_"] = dictionary[key]
         try:
-            for elem in self._chunktypes[typename]._fields:
+            for elem in Chunk._chunktypes[typename]._fields:
 
                 if elem not in kwargs:
 
-                    kwargs[elem] = self.__emptyvalue #emptyvalues are explicitly added to attributes that were left out
-                    dictionary[elem[:-1]] = self.__emptyvalue #emptyvalues are also added to attributes in the original dictionary (since this might be used for chunktype creation later)
+                    kwargs[elem] = Chunk.__emptyvalue #emptyvalues are explicitly added to attributes that were left out
+                    dictionary[elem[:-1]] = Chunk.__emptyvalue #emptyvalues are also added to attributes in the original dictionary (since this might be used for chunktype creation later)
 
-            if set(self._chunktypes[typename]._fields) != set(kwargs.keys()):
+            if set(Chunk._chunktypes[typename]._fields) != set(kwargs.keys()):
 
                 chunktype(typename, dictionary.keys())  #If there are more args than in the original chunktype, chunktype has to be created again, with slots for new attributes
                 warnings.warn("Chunk type %s is extended with new attributes" % typename)
@@ -135,11 +139,96 @@ class Chunk(collections.Sequence):
             warnings.warn("Chunk type %s was not defined; added automatically" % typename)
 
         finally:
-            self.actrchunk = self._chunktypes[typename](**kwargs)
+            actrchunk = Chunk._chunktypes[typename](**kwargs)
+
+        return Chunk._create(typename, actrchunk)
+
+    def __init__(self, typename, **dictionary):
+        pass #chunks are created in __new__
+
+    @staticmethod
+    def build(typename, dictionary):
+        """
+        Create a chunk of typename out of dictionary of slots and values that were already checked, i.e., values of other chunks or values created by Template. This is equivalent to Chunk(typename, **dictionary), but skips checks of values.
+
+        If some values are not VarvalClass or empty values, or slots do not fit the chunk type, Chunk(typename, **dictionary) is used.
+        """
+        try:
+            fields = Chunk._chunktypes[typename]._fields
+        except KeyError:
+            return Chunk(typename, **dictionary)
+        kwargs = dict.fromkeys(fields, Chunk.__emptyvalue) #emptyvalues are explicitly added to attributes that were left out
+        for key, value in dictionary.items():
+            slot = key + "_"
+            if slot not in kwargs:
+                return Chunk(typename, **dictionary)
+            elif isinstance(value, utilities.VarvalClass):
+                kwargs[slot] = value
+            elif isinstance(value, Chunk.EmptyValue):
+                kwargs[slot] = Chunk.__nonevalue #Chunk() turns given empty values into 'None'
+            else:
+                return Chunk(typename, **dictionary)
+        return Chunk._create(typename, Chunk._chunktypes[typename](**kwargs))
+
+    @staticmethod
+    def _create(typename, actrchunk):
+        """
+        Create a chunk out of its type and actrchunk, the namedtuple of its slots. Chunks without variables are looked up among interned chunks first.
+        """
+        if any(isinstance(x, utilities.VarvalClass) and (x.variables or x.negvariables or isinstance(x.values, PatternChunk)) for x in actrchunk):
+            chunk = object.__new__(PatternChunk)
+            key = None
+        else:
+            key = Chunk.__structkey(typename, actrchunk)
+            try:
+                return Chunk._interned[key]
+            except KeyError:
+                chunk = object.__new__(Chunk)
+        chunk.typename = typename
+        chunk.actrchunk = actrchunk
+        chunk._boundvars = None #dict of bound variables, created when needed
+        chunk.__empty = None #this will store what the chunk looks like without empty values (the values will be stored on the first call of the relevant function)
+        chunk.__unused = None #this will store what the chunk looks like without unused values
+        chunk.__hash = None, {} #this will store the hash along with variables (hash changes if some variables are resolved)
+        if key is not None:
+            chunk.__hash = hash(chunk), None #no variables, so the hash never changes
+            Chunk._interned[key] = chunk
+        return chunk
+
+    @staticmethod
+    def __structkey(typename, actrchunk):
+        """
+        Structural key of a chunk without variables, under which it is interned.
+        """
+        return typename, actrchunk._fields, tuple(Chunk.__internkey(x) for x in actrchunk)
+
+    @staticmethod
+    def __internkey(value):
+        """
+        Part of the structural key of a chunk that comes from one slot value. Chunks used as values are already interned, so they are keyed by their identity (wrapped in a tuple so that they differ from strings); the id stays valid as long as the key, since the chunk carrying the key keeps its values alive.
+        """
+        if isinstance(value, utilities.VarvalClass):
+            return tuple((id(x),) if isinstance(x, Chunk) else x for x in (value.values, value.variables)) + (tuple((id(x),) if isinstance(x, Chunk) else x for x in value.negvalues), value.negvariables)
+        elif isinstance(value, Chunk):
+            return (id(value),)
+        else:
+            return () #empty value
 
-        self.__empty = None #this will store what the chunk looks like without empty values (the values will be stored on the first call of the relevant function)
-        self.__unused = None #this will store what the chunk looks like without unused values
-        self.__hash = None, self.boundvars.copy() #this will store the hash along with variables (hash changes if some variables are resolved)
+    def __reduce__(self):
+        return _rebuild_chunk, (self.typename, self.actrchunk._fields, tuple(tuple(x) if isinstance(x, utilities.VarvalClass) else None for x in self.actrchunk))
+
+    @property
+    def boundvars(self):
+        """
+        Dict of bound variables.
+        """
+        if self._boundvars is None:
+            self._boundvars = {}
+        return self._boundvars
+
+    @boundvars.setter
+    def boundvars(self, value):
+        self._boundvars = value
 
     def _asdict(self):
         """
@@ -150,12 +239,14 @@ class Chunk(collections.Sequence):
         return dictionary
 
     def __eq__(self, otherchunk):
-        if hash(self) == hash(otherchunk):
+        if self is otherchunk or hash(self) == hash(otherchunk):
             return True
         else:
             return False
 
     def __getattr__(self, name):
+        if name == "actrchunk":
+            raise AttributeError("Chunk has no such attribute") #not created yet
         if hasattr(self.actrchunk, name + "_"):
             return getattr(self.actrchunk, name + "_")
         else:
@@ -165,7 +256,7 @@ class Chunk(collections.Sequence):
         return re.sub("_$", "", self.actrchunk._fields[pos]), self.actrchunk[pos]
 
     def __hash__(self):
-        if self.__hash[0] and self.boundvars == self.__hash[1]:
+        if self.__hash[1] is None or (self.__hash[0] and self.boundvars == self.__hash[1]):
             return self.__hash[0]
         def hash_func():
             for x in self.removeempty():
@@ -348,13 +439,194 @@ class Chunk(collections.Sequence):
             self.__unused = tuple(unusing_func())
         return self.__unused
 
+class PatternChunk(Chunk):
+    """
+    Chunks with variables, used as patterns (e.g., in production rules). They are not interned, since every pattern carries its own bound variables, and their hash depends on them.
+    """
+
+    __slots__ = ()
+
+class Pattern(object):
+    """
+    Compiled pattern, used to test chunks (e.g., in LHS of production rules or in retrieval requests).
+
+    Unlike pattern <= chunk, matching takes bound variables as an argument and leaves the pattern unchanged, and slot values are compared directly, without hashing the pattern.
+    """
+
+    __slots__ = ("chunk", "slots", "negative", "empty")
+
+    _patterns = {} #compiled patterns, see compile
+
+    __emptyvalue = Chunk.EmptyValue()
+
+    def __init__(self, chunk):
+        self.chunk = chunk
+        slots = []
+        for slot, value in chunk:
+            varval = utilities.splitting(value)
+            if varval.variables or varval.negvariables or varval.values or varval.negvalues:
+                slots.append((slot + "_", varval.variables, tuple(varval.negvariables), varval.values, tuple((negval, negval in {self.__emptyvalue, 'None'}) for negval in varval.negvalues)))
+        self.slots = tuple(slots)
+        self.negative = any(x[2] or x[4] for x in slots) #negative tests are checked against chunk itself in some cases
+        self.empty = any(x[3] in {self.__emptyvalue, 'None'} for x in slots) #so are failed tests of empty values
+
+    @staticmethod
+    def compile(chunk):
+        """
+        Return compiled pattern for chunk, reusing patterns compiled earlier.
+        """
+        key = chunk.actrchunk._fields, tuple(chunk.actrchunk)
+        try:
+            return Pattern._patterns[key]
+        except KeyError:
+            if len(Pattern._patterns) > 10000:
+                Pattern._patterns.clear()
+            pattern = Pattern._patterns[key] = Pattern(chunk)
+            return pattern
+
+    def match(self, otherchunk, bindings):
+        """
+        Check that otherchunk matches the pattern, given bindings (dict of bound variables). Return a new dict of bindings, updated with variables bound by the match, or None if otherchunk does not match.
+
+        This agrees with pattern <= otherchunk, with boundvars set to bindings.
+        """
+        if isinstance(otherchunk, PatternChunk) or (self.negative and any(isinstance(x, utilities.VarvalClass) and x.negvalues for x in otherchunk.actrchunk)):
+            return self.__compare(otherchunk, bindings)
+        bound = self.__match(otherchunk, bindings)
+        if bound is None and self.empty:
+            return self.__compare(otherchunk, bindings)
+        return bound
+
+    def __compare(self, otherchunk, bindings):
+        """
+        Check pattern <= otherchunk. This is needed when pattern <= otherchunk could succeed because the two chunks are equal even though the pattern does not match otherchunk slot by slot.
+        """
+        self.chunk.boundvars = dict(bindings)
+        if self.chunk <= otherchunk:
+            return dict(self.chunk.boundvars)
+        else:
+            return None
+
+    def __match(self, otherchunk, bindings):
+        """
+        Match otherchunk slot by slot.
+        """
+        bound = dict(bindings)
+        for slot, variable, negvariables, value, negvalues in self.slots:
+            try:
+                matching_val = getattr(otherchunk.actrchunk, slot) #get the value of attr
+            except AttributeError:
+                matching_val = None #if it is missing, it must be None
+            if isinstance(matching_val, utilities.VarvalClass):
+                matching_val = matching_val.values
+            if variable:
+                for each in bound.get("~=" + variable, ()):
+                    if each == matching_val:
+                        return None
+                try:
+                    if bound["=" + variable] != matching_val:
+                        return None
+                except KeyError:
+                    bound["=" + variable] = matching_val
+            for var in negvariables:
+                try:
+                    if bound["=" + var] == matching_val:
+                        return None
+                except KeyError:
+                    pass
+                bound["~=" + var] = bound.get("~=" + var, set()) | {matching_val}
+            if value:
+                if value != None and value != matching_val:
+                    return None
+            for negval, empty in negvalues:
+                if negval == matching_val or (empty and matching_val == self.__emptyvalue):
+                    return None
+        return bound
+
+class Template(object):
+    """
+    Compiled chunk used to set or modify chunks in buffers (e.g., in RHS of production rules). Slots are split into constants (their values are created once), variables (their values are looked up) and other slots (negations, special values etc.), which are checked by utilities.check_bound_vars when the template is filled in.
+    """
+
+    __slots__ = ("chunk", "slots")
+
+    _CONSTANT, _VARIABLE, _OTHER = range(3)
+
+    _templates = {} #id of chunks -> chunks and their compiled templates, see compile
+
+    __special = {utilities.VISIONGREATER, utilities.VISIONSMALLER}
+
+    def __init__(self, chunk):
+        self.chunk = chunk
+        slots = []
+        for slot, value in chunk.removeunused():
+            varval = utilities.splitting(value)
+            if varval.negvalues or varval.negvariables:
+                slots.append((slot, self._OTHER, value, None))
+            elif varval.variables and not varval.values:
+                slots.append((slot, self._VARIABLE, value, utilities.ACTRVARIABLE + varval.variables))
+            elif varval.values and not varval.variables and varval.values not in self.__special:
+                slots.append((slot, self._CONSTANT, value, utilities.VarvalClass(variables=None, values=varval.values, negvariables=(), negvalues=())))
+            else:
+                slots.append((slot, self._OTHER, value, None))
+        self.slots = tuple(slots)
+
+    @staticmethod
+    def compile(chunk):
+        """
+        Return compiled template for chunk, reusing templates compiled earlier.
+        """
+        try:
+            compiled_chunk, template = Template._templates[id(chunk)]
+        except KeyError:
+            pass
+        else:
+            if compiled_chunk is chunk:
+                return template
+        if len(Template._templates) > 10000:
+            Template._templates.clear()
+        template = Template(chunk)
+        Template._templates[id(chunk)] = chunk, template
+        return template
+
+    def fill(self, actrvariables):
+        """
+        Return dict of slots and values, with variables replaced by their values in actrvariables. This agrees with using utilities.check_bound_vars on every slot of chunk.removeunused().
+        """
+        filled = {}
+        for slot, kind, value, compiled in self.slots:
+            if kind == self._CONSTANT:
+                filled[slot] = compiled
+                continue
+            elif kind == self._VARIABLE:
+                bound = actrvariables.get(compiled, self)
+                if bound is not self and bound not in self.__special:
+                    filled[slot] = utilities.VarvalClass(variables=None, values=bound if bound else None, negvariables=(), negvalues=())
+                    continue
+            filled[slot] = utilities.check_bound_vars(actrvariables, value) #other slots, unbound variables (this raises an error) and special values
+        return filled
+
+def _rebuild_chunk(typename, fields, values):
+    """
+    Recreate a pickled chunk.
+    """
+    try:
+        chunktype_class = Chunk._chunktypes[typename]
+        if chunktype_class._fields != fields:
+            raise KeyError
+    except KeyError:
+        chunktype_class = collections.namedtuple(typename, fields)
+    return Chunk._create(typename, chunktype_class(*(Chunk.EmptyValue() if x is None else utilities.VarvalClass(*x) for x in values)))
+
 #special chunk that can be used in production rules
 for key in utilities.SPECIALCHUNKTYPES:
     chunktype(key, utilities.SPECIALCHUNKTYPES[key])
 
-def createchunkdict(chunk):
+def createchunkdict(chunk, lookups=None):
     """
     Create typename and chunkdict from pyparsed list.
+
+    If lookups is a dict, it collects names looked up in the database of chunks, along with the chunk found (or None).
     """
     sp_dict = {utilities.ACTRVARIABLE: "variables", utilities.ACTRNEG: "negvalues", utilities.ACTRNEG + utilities.ACTRVARIABLE: "negvariables", utilities.ACTRVALUE: "values", utilities.ACTRNEG + utilities.ACTRVALUE: "negvalues"}
     chunk_dict = {}
@@ -388,6 +660,11 @@ def createchunkdict(chunk):
                     #if not, save it as a string
                     except KeyError:
                         update_val = elem[idx]
+                        if lookups is not None:
+                            lookups[elem[idx]] = None
+                    else:
+                        if lookups is not None:
+                            lookups[elem[idx]] = update_val
                 updating = 'values'
             finally:
                 temp_dict[updating].add(update_val)
@@ -461,6 +738,8 @@ def makechunk(nameofchunk="", typename="", **dictionary):
     created_chunk._chunks[nameofchunk] = created_chunk
     return created_chunk
 
+_chunkstrings = {} #chunk strings -> typename, chunkdict and names looked up in the database of chunks, from the least to the most recently used
+
 def chunkstring(name='', string=''):
     """
     Create a chunk when given a string. The string is specified in the form: slot value slot value (arbitrary number of slot-value pairs can be used). isa-slot is used as the type of chunk. If no isa-slot is provided, chunk is assigned an 'undefined' type.
@@ -469,12 +748,20 @@ def chunkstring(name='', string=''):
     >>> chunkstring(name="example0", string='isa chunktype_example0 value one')
     chunktype_example0(value= one)
     """
-    chunk_reader = utilities.getchunk()
-    chunk = chunk_reader.parseString(string, parseAll=True)
     try:
-        type_chunk, chunk_dict = createchunkdict(chunk)
-    except utilities.ACTRError as e:
-        raise utilities.ACTRError("The chunk string %s is not defined correctly; %s" %(string, e))
+        type_chunk, chunk_dict, lookups = _chunkstrings.pop(string)
+        if any(Chunk._chunks.get(x) is not lookups[x] for x in lookups):
+            raise KeyError #a name now refers to a different chunk
+    except KeyError:
+        chunk = utilities.parsechunk(string)
+        lookups = {}
+        try:
+            type_chunk, chunk_dict = createchunkdict(chunk, lookups)
+        except utilities.ACTRError as e:
+            raise utilities.ACTRError("The chunk string %s is not defined correctly; %s" %(string, e))
+        if len(_chunkstrings) >= 4096:
+            del _chunkstrings[next(iter(_chunkstrings))] #drop the least recently used string
+    _chunkstrings[string] = type_chunk, chunk_dict, lookups
 
     created_chunk = makechunk(name, type_chunk, **chunk_dict)
     return created_chunk
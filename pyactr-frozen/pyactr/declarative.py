@@ -11,16 +11,236 @@ import pyactr.chunks as chunks
 import pyactr.utilities as utilities
 import pyactr.buffers as buffers
 
+class TimeStore(object):
+    """
+    Presentation times of chunks, kept in one growable array (CSR style).
+
+    Every row owns a segment of the array, given by its start, length and capacity. A row that outgrows its segment moves to the end of the array with double the capacity; the array doubles when it is full, and segments that were left behind are dropped at that point. No position in the array is written twice, so views handed out earlier never change.
+    """
+
+    def __init__(self, size=16):
+        self._times = np.empty(size)
+        self._end = 0 #first position in _times not yet given to any segment
+        self._starts = np.zeros(size, dtype=int)
+        self._lengths = np.zeros(size, dtype=int)
+        self._capacities = np.zeros(size, dtype=int)
+        self._live = np.zeros(size, dtype=bool)
+        self._dropped = np.zeros(size, dtype=int) #number of presentations dropped from a row by truncate
+        self._firsts = np.full(size, np.inf) #time of the first dropped presentation
+        self._free = [] #rows that can be reused
+        self._rows = 0 #rows used so far
+
+    def __allocate(self, size):
+        """
+        Reserve size positions at the end of the array and return the start of the reserved segment.
+        """
+        if self._end + size > len(self._times):
+            rows = np.flatnonzero(self._live)
+            capacities = self._capacities[rows]
+            starts = np.cumsum(capacities) - capacities
+            times = np.empty(max(16, 2*(int(np.sum(capacities)) + size)))
+            gathered, _ = self.gather(rows)
+            times[self.__positions(starts, self._lengths[rows])] = gathered
+            self._times = times
+            self._starts[rows] = starts
+            self._end = int(np.sum(capacities))
+        start = self._end
+        self._end += size
+        return start
+
+    @staticmethod
+    def __positions(starts, lengths):
+        """
+        Positions covered by segments given by their starts and lengths.
+        """
+        offsets = np.cumsum(lengths) - lengths
+        return np.repeat(starts - offsets, lengths) + np.arange(np.sum(lengths, dtype=int))
+
+    def add_row(self, times):
+        """
+        Store times in a new row and return the row.
+        """
+        if self._free:
+            row = self._free.pop()
+        else:
+            if self._rows == len(self._starts):
+                for attr in ["_starts", "_lengths", "_capacities", "_live", "_dropped", "_firsts"]:
+                    setattr(self, attr, np.concatenate((getattr(self, attr), np.zeros_like(getattr(self, attr)))))
+            row = self._rows
+            self._rows += 1
+        self._live[row] = True
+        self._lengths[row] = 0
+        self._capacities[row] = 0
+        self.replace(row, times)
+        return row
+
+    def remove_row(self, row):
+        """
+        Remove row; its segment will be dropped once the array is reallocated.
+        """
+        self._live[row] = False
+        self._lengths[row] = 0
+        self._capacities[row] = 0
+        self._free.append(row)
+
+    def get(self, row):
+        """
+        Return times stored in row (as a view).
+        """
+        start = self._starts[row]
+        return self._times[start:start+self._lengths[row]]
+
+    def append(self, row, times):
+        """
+        Add times at the end of row.
+        """
+        times = np.ravel(times)
+        length = self._lengths[row]
+        if length + len(times) > self._capacities[row]:
+            capacity = 2*(length + len(times))
+            start = self.__allocate(capacity)
+            old_start = self._starts[row] #could have moved during allocation
+            self._times[start:start+length] = self._times[old_start:old_start+length]
+            self._starts[row] = start
+            self._capacities[row] = capacity
+        start = self._starts[row] + length
+        self._times[start:start+len(times)] = times
+        self._lengths[row] = length + len(times)
+
+    def replace(self, row, times):
+        """
+        Replace times stored in row. The row is moved to a fresh segment, so that earlier views are not affected.
+        """
+        times = np.ravel(times)
+        start = self.__allocate(len(times))
+        self._times[start:start+len(times)] = times
+        self._starts[row] = start
+        self._lengths[row] = len(times)
+        self._capacities[row] = len(times)
+        self._dropped[row] = 0
+        self._firsts[row] = np.inf
+
+    def truncate(self, row, size):
+        """
+        Keep only the size most recent times of row. Dropped times are summarized by their number and the earliest of them (see dropped).
+        """
+        times = np.sort(self.get(row))
+        if len(times) > size:
+            dropped, first = self._dropped[row] + len(times) - size, min(self._firsts[row], times[0])
+            self.replace(row, times[len(times)-size:])
+            self._dropped[row], self._firsts[row] = dropped, first
+
+    def dropped(self, rows):
+        """
+        Return the numbers of times dropped from rows, along with the earliest dropped time of each row (inf if nothing was dropped).
+        """
+        rows = np.asarray(rows, dtype=int)
+        return self._dropped[rows], self._firsts[rows]
+
+    def gather(self, rows):
+        """
+        Return times of rows in one array, along with the offset of each row in that array.
+        """
+        rows = np.asarray(rows, dtype=int)
+        lengths = self._lengths[rows]
+        return self._times[self.__positions(self._starts[rows], lengths)], np.cumsum(lengths) - lengths
+
+    def copy(self):
+        """
+        Copy stored times.
+        """
+        store = TimeStore.__new__(TimeStore)
+        store.__dict__.update({key: value.copy() if isinstance(value, (np.ndarray, list)) else value for key, value in self.__dict__.items()})
+        return store
+
+class SimilarityMatrix(collections.MutableMapping):
+    """
+    Similarities between values (chunks or strings) used in partial matching.
+
+    It works like a dictionary whose keys are pairs of values. Values are interned and similarities are kept in a dense array, so that similarities of many pairs can be looked up at once.
+    """
+
+    def __init__(self, data=None):
+        self._ids = {} #values -> their positions in the array
+        self._values = []
+        self._matrix = np.full((0, 0), np.nan) #nan marks similarities that were not set
+        self.version = 0 #changes whenever similarities change
+        if data is not None:
+            self.update(data)
+
+    def __contains__(self, pair):
+        try:
+            self[pair]
+        except KeyError:
+            return False
+        return True
+
+    def __delitem__(self, pair):
+        self[pair] #raises KeyError if not present
+        self._matrix[self._ids[pair[0]], self._ids[pair[1]]] = np.nan
+        self.version += 1
+
+    def __getitem__(self, pair):
+        similarity = self._matrix[self._ids[pair[0]], self._ids[pair[1]]]
+        if np.isnan(similarity):
+            raise KeyError(pair)
+        return similarity
+
+    def __iter__(self):
+        for x, y in zip(*np.nonzero(~np.isnan(self._matrix))):
+            yield self._values[x], self._values[y]
+
+    def __len__(self):
+        return int(np.sum(~np.isnan(self._matrix)))
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def __setitem__(self, pair, value):
+        for x in pair:
+            if x not in self._ids:
+                self._ids[x] = len(self._values)
+                self._values.append(x)
+        if len(self._values) > len(self._matrix):
+            matrix = np.full((2*len(self._values), 2*len(self._values)), np.nan)
+            matrix[:len(self._matrix), :len(self._matrix)] = self._matrix
+            self._matrix = matrix
+        self._matrix[self._ids[pair[0]], self._ids[pair[1]]] = value
+        self.version += 1
+
+    def position(self, value):
+        """
+        Position of value in the array, or -1 if value has no similarity set.
+        """
+        return self._ids.get(value, -1)
+
+    def lookup(self, positions, position):
+        """
+        Return similarities of values at positions to the value at position, with nan where no similarity is set.
+        """
+        if position < 0:
+            return np.full(len(positions), np.nan)
+        return np.where(positions >= 0, self._matrix[positions, position], np.nan)
+
 class DecMem(collections.MutableMapping):
     """
     Declarative memory module.
     """
 
     def __init__(self, data=None):
-        self._data = {}
-        self.restricted_number_chunks = collections.Counter() #counter for pairs of slot - value, used to store strength association
-        self.unrestricted_number_chunks = collections.Counter() # counter for chunks, used to store strength association
+        self._data = {} #chunks -> rows of _store
+        self._store = TimeStore() #presentation times of chunks
+        self.restricted_number_chunks = collections.Counter() #fan index: counter for pairs of slot - value, used to store strength association
+        self.unrestricted_number_chunks = collections.Counter() #fan index: counter for values in any slot, used to store strength association
         self.activations  = {}
+        self._index = {} #(slot, value) pairs -> chunks carrying them, kept in the order in which chunks entered dm
+        self._associations = {} #sparse chunk-by-source matrix used for spreading activation: values -> {row: number of slots carrying the value}
+        self._association_arrays = {} #columns of _associations as arrays, created when needed
+        self._value_ids = {None: 0} #values interned for partial matching; empty and missing values are None
+        self._values = [None]
+        self._slot_values = {} #slots -> array of interned values of every row
+        self._similarity_positions = None, None, np.zeros(0, dtype=int) #interned values translated into positions of a SimilarityMatrix
+        self._history = None
         if data is not None:
             try:
                 self.update(data)
@@ -29,43 +249,242 @@ class DecMem(collections.MutableMapping):
 
     def __contains__(self, elem):
         return elem in self._data
+
+    @property
+    def history(self):
+        """
+        Number of the most recent presentations stored for every chunk (None if all presentations are stored).
+
+        Older presentations are only kept as their number and the time of the first of them, which is what hybrid optimized learning needs. Chunks may store up to twice as many presentations before they are truncated, so that truncation does not happen on every presentation.
+        """
+        return self._history
+
+    @history.setter
+    def history(self, value):
+        if value is not None:
+            if int(value) != value or value < 1:
+                raise utilities.ACTRError("History must be a positive integer or None, not '%s'" % value)
+            for row in self._data.values():
+                self._store.truncate(row, value)
+        self._history = value
     
     def __delitem__(self, key):
-        del self._data[key]
+        row = self._data.pop(key)
+        self._store.remove_row(row)
+        for slot, _ in key:
+            self._slot_values[slot][row] = 0
+        for slotvalue in self.__slotvalues(key):
+            posting = self._index[slotvalue]
+            del posting[key]
+            if not posting:
+                del self._index[slotvalue]
+            if slotvalue[1]:
+                for counter, counted in ((self.unrestricted_number_chunks, slotvalue[1]), (self.restricted_number_chunks, slotvalue)):
+                    counter[counted] -= 1
+                    if not counter[counted]:
+                        del counter[counted]
+            if self.__is_source(slotvalue[1]):
+                column = self._associations[slotvalue[1]]
+                column[row] -= 1
+                if not column[row]:
+                    del column[row]
+                if not column:
+                    del self._associations[slotvalue[1]]
+                self._association_arrays.pop((None, slotvalue[1]), None)
+                self._association_arrays.pop(slotvalue, None)
 
     def __iter__(self):
         for elem in self._data:
             yield elem
 
     def __getitem__(self, key):
-        return self._data[key]
+        return self._store.get(self._data[key])
 
     def __len__(self):
         return len(self._data)
 
     def __repr__(self):
-        return repr(self._data)
+        return repr({key: self[key] for key in self._data})
 
     def __setitem__(self, key, time):
-        if self.unrestricted_number_chunks and key not in self:
-            for x in key:
-                if utilities.splitting(x[1]).values and utilities.splitting(x[1]).values in self.unrestricted_number_chunks:
-                    self.unrestricted_number_chunks.update([utilities.splitting(x[1]).values])
-        if self.restricted_number_chunks and key not in self:
-            for x in key:
-                if utilities.splitting(x[1]).values and (x[0], utilities.splitting(x[1]).values) in self.restricted_number_chunks:
-                    self.restricted_number_chunks.update([(x[0], utilities.splitting(x[1]).values)])
         if isinstance(key, chunks.Chunk):
-            if isinstance(time, np.ndarray):
-                self._data[key] = time
-            else:
+            if not isinstance(time, np.ndarray):
                 try:
-                    self._data[key] = np.array([round(float(time), 4)])
+                    time = np.array([round(float(time), 4)])
                 except TypeError:
-                    self._data[key] = np.array(time)
+                    time = np.array(time)
+            if key in self._data:
+                self._store.replace(self._data[key], time)
+                if self._history and np.size(time) > self._history:
+                    self._store.truncate(self._data[key], self._history)
+            else:
+                row = self._store.add_row(time)
+                self._data[key] = row
+                if self._history and np.size(time) > self._history:
+                    self._store.truncate(row, self._history)
+                for slot, value in key:
+                    self.__set_slot_value(slot, row, value.values if isinstance(value, utilities.VarvalClass) else None)
+                for slotvalue in self.__slotvalues(key):
+                    self._index.setdefault(slotvalue, {})[key] = None
+                    if slotvalue[1]:
+                        self.unrestricted_number_chunks[slotvalue[1]] += 1
+                        self.restricted_number_chunks[slotvalue] += 1
+                    if self.__is_source(slotvalue[1]):
+                        column = self._associations.setdefault(slotvalue[1], {})
+                        column[row] = column.get(row, 0) + 1
+                        self._association_arrays.pop((None, slotvalue[1]), None)
+                        self._association_arrays.pop(slotvalue, None)
         else:
             raise utilities.ACTRError("Only chunks can be added as attributes to Declarative Memory; '%s' is not a chunk" % key)
     
+    @staticmethod
+    def __slotvalues(chunk):
+        """
+        Slot-value pairs under which chunk is indexed (empty slots are not indexed).
+        """
+        for slot, value in chunk:
+            if isinstance(value, utilities.VarvalClass) and value.values is not None:
+                yield slot, value.values
+
+    @staticmethod
+    def __is_source(value):
+        """
+        Can value be a source of spreading activation (see utilities.find_chunks)?
+        """
+        return value != utilities.EMPTYVALUE and value != str(utilities.EMPTYVALUE)
+
+    def __association(self, value, slot=None):
+        """
+        Return rows of chunks associated with value, along with the number of their slots carrying value. If slot is given, only chunks carrying value in slot are returned.
+        """
+        try:
+            return self._association_arrays[(slot, value)]
+        except KeyError:
+            column = self._associations.get(value, {})
+            if slot is None:
+                rows = np.fromiter(column.keys(), dtype=int, count=len(column))
+                counts = np.fromiter(column.values(), dtype=int, count=len(column))
+            else:
+                rows = np.array([self._data[x] for x in self._index.get((slot, value), {})], dtype=int)
+                counts = np.array([column[x] for x in rows], dtype=int)
+            self._association_arrays[(slot, value)] = rows, counts
+            return rows, counts
+
+    def __set_slot_value(self, slot, row, value):
+        """
+        Record the interned value of slot in row.
+        """
+        try:
+            value_id = self._value_ids[value]
+        except KeyError:
+            value_id = self._value_ids[value] = len(self._values)
+            self._values.append(value)
+        column = self._slot_values.setdefault(slot, np.zeros(len(self._store._starts), dtype=int))
+        if row >= len(column):
+            column = self._slot_values[slot] = np.concatenate((column, np.zeros(len(self._store._starts)-len(column), dtype=int)))
+        column[row] = value_id
+
+    def partial_matching(self, elements, pattern, similarities, mismatch_penalty=1):
+        """
+        Calculate partial matching of pattern to all elements at once; this gives the same values as pattern.match(element, partialmatching=True) with similarities as Chunk._similarities.
+
+        similarities is a SimilarityMatrix. Pattern may only carry values and negative values; variables and 'None' values in the pattern raise ValueError.
+        """
+        rows = np.array([self._data[x] for x in elements], dtype=int)
+        matrix, version, positions = self._similarity_positions
+        if matrix is not similarities or version != similarities.version:
+            positions = np.zeros(0, dtype=int)
+        if len(positions) < len(self._values): #translate newly interned values into positions of similarities
+            positions = np.concatenate((positions, np.array([similarities.position(x) for x in self._values[len(positions):]], dtype=int)))
+        self._similarity_positions = similarities, similarities.version, positions
+
+        A_pm = np.zeros(len(elements))
+        for slot, value in pattern:
+            varval = utilities.splitting(value)
+            if varval.variables or varval.negvariables:
+                raise ValueError("Variables must be resolved before partial matching")
+            if varval.values:
+                values = [varval.values]
+            else:
+                values = []
+            values.extend(varval.negvalues)
+            if any(val == utilities.EMPTYVALUE or val == str(utilities.EMPTYVALUE) for val in values):
+                raise ValueError("Empty values are not supported")
+            found = np.zeros(len(rows), dtype=int) #0 -- no value (also for chunks without this slot)
+            column = self._slot_values.get(slot)
+            if column is not None:
+                inside = rows < len(column) #columns only grow when a chunk with the slot is added, later rows have no value
+                found[inside] = column[rows[inside]]
+            for idx, val in enumerate(values):
+                if idx == 0 and varval.values:
+                    similarity = similarities.lookup(positions[found], similarities.position(val))
+                    penalty = np.where(np.isnan(similarity), -mismatch_penalty, similarity)
+                    penalty[found == self._value_ids.get(val, -1)] = 0
+                else:
+                    penalty = np.zeros(len(rows))
+                    same = found == self._value_ids.get(val, -1)
+                    if same.any():
+                        penalty[same] = similarities.get((val, val), -mismatch_penalty)
+                A_pm += penalty
+        if pattern in self._data: #a chunk equal to the pattern matches fully
+            A_pm[rows == self._data[pattern]] = 0
+        return A_pm
+
+    def spreading_activation(self, elements, sources, strength, restricted=False):
+        """
+        Calculate spreading activation for all elements at once; this gives the same values as utilities.spreading_activation for each element.
+
+        sources are collected by utilities.spreading_sources. Each source value j selects a column of the sparse chunk-by-source matrix, that is, chunks i carrying j in some slot, and S_ji is added to them.
+
+        restricted states whether spreading activation should be restricted only to chunk names that share the same slot names.
+        """
+        SA = np.zeros(len(elements))
+        if not sources:
+            return SA
+        rows = np.array([self._data[x] for x in elements], dtype=int)
+        positions = np.full(len(self._store._starts), -1)
+        positions[rows] = np.arange(len(elements))
+        for weight, slotvalues in sources:
+            s_ji = np.zeros(len(elements))
+            for slot, value in slotvalues:
+                if restricted:
+                    associated, counts = self.__association(value, slot)
+                    slots_j = 1 + self.restricted_number_chunks[(slot, value)]
+                else:
+                    associated, counts = self.__association(value)
+                    slots_j = 1 + self.unrestricted_number_chunks[value]
+                found = positions[associated]
+                counts = counts[found >= 0]
+                found = found[found >= 0]
+                if len(found) > 0:
+                    unique_counts, inverse = np.unique(counts, return_inverse=True)
+                    s_ji[found] += np.array([strength - math.log(slots_j/max(1, count)) for count in unique_counts])[inverse]
+                if not restricted and value in self._data: #the source itself is associated with itself, even if it does not carry itself as a value
+                    position = positions[self._data[value]]
+                    if position >= 0 and position not in found:
+                        s_ji[position] += strength - math.log(slots_j)
+            SA += weight*s_ji
+        return SA
+
+    def candidates(self, chunk):
+        """
+        Find chunks that could match chunk, in the order in which they are stored in dm.
+
+        Only slots with a bound value (a string other than 'None', or a chunk) narrow the search, by intersecting the chunks indexed under the slot-value pairs. Variables, negations and empty values are left to the full match, which still has to be run on the candidates. Chunk types are not used since matching ignores them.
+        """
+        postings = []
+        for slot, value in chunk.removeunused():
+            try:
+                val = value.values
+            except AttributeError:
+                continue
+            if (isinstance(val, str) and val != str(utilities.EMPTYVALUE)) or isinstance(val, chunks.Chunk):
+                postings.append(self._index.get((slot, val), {}))
+        if not postings:
+            return self._data
+        postings.sort(key=len)
+        return [x for x in postings[0] if all(x in posting for posting in postings[1:])]
+
     def add_activation(self, element, activation):
         """
         Add activation of an element.
@@ -84,30 +503,55 @@ class DecMem(collections.MutableMapping):
         element can be either one chunk, or an iterable of chunks.
         """
         if isinstance(time, collections.abc.Iterable):
-            try:
-                new = np.concatenate((self.setdefault(element, np.array([])), np.array(time)))
-                self[element] = new
-            except TypeError:
-                for x in element:
-                    new = np.concatenate((self.setdefault(x, np.array([])), np.array(time)))
-                    self[x] = new
+            time = np.array(time)
         else:
-            try:
-                new = np.append(self.setdefault(element, np.array([])), round(float(time), 4))
-                self[element] = new
-            except TypeError:
-                for x in element:
-                    new = np.append(self.setdefault(x, np.array([])), round(float(time), 4))
-                    self[x] = new
+            time = round(float(time), 4)
+        try:
+            self.__append(element, time)
+        except TypeError:
+            for x in element:
+                self.__append(x, time)
+
+    def __append(self, element, time):
+        """
+        Add time to the times of element, adding the element if it is new.
+        """
+        if element in self._data:
+            row = self._data[element]
+            self._store.append(row, time)
+            if self._history and self._store._lengths[row] > 2*self._history:
+                self._store.truncate(row, self._history)
+        else:
+            self[element] = np.ravel(np.array(time, dtype=float))
+
+    def times(self, elements):
+        """
+        Return presentation times of elements in one array, along with the offset at which the times of each element start (CSR style).
+        """
+        return self._store.gather([self._data[x] for x in elements])
+
+    def dropped(self, elements):
+        """
+        Return the numbers of presentations of elements no longer stored (see history), along with the time of the first of them.
+        """
+        return self._store.dropped([self._data[x] for x in elements])
 
     def copy(self):
         """
         Copy declarative memory.
         """
-        dm = DecMem(self._data.copy())
+        dm = DecMem()
+        dm._data = self._data.copy()
+        dm._store = self._store.copy()
+        dm._index = {key: value.copy() for key, value in self._index.items()}
+        dm._associations = {key: value.copy() for key, value in self._associations.items()}
+        dm._value_ids = self._value_ids.copy()
+        dm._values = list(self._values)
+        dm._slot_values = {key: value.copy() for key, value in self._slot_values.items()}
         dm.activations = self.activations.copy()
         dm.restricted_number_chunks = self.restricted_number_chunks.copy()
         dm.unrestricted_number_chunks = self.unrestricted_number_chunks.copy()
+        dm._history = self._history
         return dm
 
 class DecMemBuffer(buffers.Buffer):
@@ -196,55 +640,31 @@ class DecMemBuffer(buffers.Buffer):
             raise utilities.ACTRError("Retrieving the chunk '%s' is impossible; %s" % (otherchunk, arg))
         chunk_tobe_matched = chunks.Chunk(otherchunk.typename, **mod_attr_val)
 
-        max_A = float("-inf")
-
         retrieved = None
-        for chunk in self.dm:
-            try:
-                if extra_tests["recently_retrieved"] == False or extra_tests["recently_retrieved"] == 'False':
-                    if self.__finst and chunk in self.recent:
-                        continue
-
-                else:
-                    if self.__finst and chunk not in self.recent:
-                        continue
-            except KeyError:
-                pass
-
-            if model_parameters["subsymbolic"]: #if subsymbolic, check activation
-                A_pm = 0
-                if model_parameters["partial_matching"]:
-                    A_pm = chunk_tobe_matched.match(chunk, partialmatching=True, mismatch_penalty=model_parameters["mismatch_penalty"])
-                else:
-                    if not chunk_tobe_matched <= chunk:
-                        continue
-
-                try:
-                    A_bll = utilities.baselevel_learning(time, self.dm[chunk], model_parameters["baselevel_learning"], model_parameters["decay"], self.dm.activations.get(chunk), optimized_learning=model_parameters["optimized_learning"]) #bll
-                except UnboundLocalError:
-                    continue
-                if math.isnan(A_bll):
-                    raise utilities.ACTRError("The following chunk cannot receive base activation: %s. The reason is that one of its traces did not appear in a past moment." % chunk)
-                A_sa = utilities.spreading_activation(chunk, buffers, self.dm, model_parameters["buffer_spreading_activation"], model_parameters["strength_of_association"], model_parameters["spreading_activation_restricted"], model_parameters["association_only_from_chunks"])
-                inst_noise = utilities.calculate_instantaneous_noise(model_parameters["instantaneous_noise"])
-                A = A_bll + A_sa + A_pm + inst_noise #chunk.activation is the manually specified activation, potentially used by the modeller
-
-                if utilities.retrieval_success(A, model_parameters["retrieval_threshold"]) and max_A < A:
-                    max_A = A
-                    self.activation = max_A
-                    retrieved = chunk
-                    extra_time = utilities.retrieval_latency(A, model_parameters["latency_factor"],  model_parameters["latency_exponent"])
-
-                    if model_parameters["activation_trace"]:
-                        print("(Partially) matching chunk:", chunk)
-                        print("Base level learning:", A_bll)
-                        print("Spreading activation", A_sa)
-                        print("Partial matching", A_pm)
-                        print("Noise:", inst_noise)
-                        print("Total activation", A)
-                        print("Time to retrieve", extra_time)
-            else: #otherwise, just standard time for rule firing, so no extra calculation needed
-                if chunk_tobe_matched <= chunk and self.dm[chunk][0] != time: #the second condition ensures that the chunk that was created are not retrieved at the same time
+        if model_parameters["subsymbolic"] and model_parameters["partial_matching"]:
+            candidates = self.dm #every chunk receives activation under partial matching
+        else:
+            candidates = self.dm.candidates(chunk_tobe_matched)
+        try:
+            if extra_tests["recently_retrieved"] == False or extra_tests["recently_retrieved"] == 'False':
+                if self.__finst:
+                    candidates = [chunk for chunk in candidates if chunk not in self.recent]
+            else:
+                if self.__finst:
+                    candidates = [chunk for chunk in candidates if chunk in self.recent]
+        except KeyError:
+            pass
+
+        if model_parameters["subsymbolic"]: #if subsymbolic, check activation
+            retrieved, extra_time = self.__retrieve_subsymbolic(time, chunk_tobe_matched, candidates, buffers, model_parameters)
+        else: #otherwise, just standard time for rule firing, so no extra calculation needed
+            if isinstance(chunk_tobe_matched, chunks.PatternChunk):
+                matches = lambda chunk: chunk_tobe_matched <= chunk #variables bound on the way are kept in chunk_tobe_matched
+            else:
+                pattern = chunks.Pattern(chunk_tobe_matched)
+                matches = lambda chunk: pattern.match(chunk, {}) is not None
+            for chunk in candidates:
+                if matches(chunk) and self.dm[chunk][0] != time: #the second condition ensures that the chunk that was created are not retrieved at the same time
                     retrieved = chunk
                     extra_time = model_parameters["rule_firing"]
 
@@ -258,4 +678,60 @@ class DecMemBuffer(buffers.Buffer):
             if self.__finst < len(self.recent):
                 self.recent.popleft()
         return retrieved, extra_time
-        
+
+    def __retrieve_subsymbolic(self, time, chunk_tobe_matched, candidates, buffers, model_parameters):
+        """
+        Score all candidates at once and return the most active one if it exceeds the retrieval threshold, along with retrieval latency.
+        """
+        if model_parameters["partial_matching"]:
+            candidates = list(candidates)
+            try:
+                if not isinstance(chunks.Chunk._similarities, SimilarityMatrix):
+                    raise ValueError("Similarities are not stored in a SimilarityMatrix")
+                A_pm = self.dm.partial_matching(candidates, chunk_tobe_matched, chunks.Chunk._similarities, model_parameters["mismatch_penalty"])
+            except ValueError:
+                A_pm = [chunk_tobe_matched.match(chunk, partialmatching=True, mismatch_penalty=model_parameters["mismatch_penalty"]) for chunk in candidates]
+        else:
+            if isinstance(chunk_tobe_matched, chunks.PatternChunk):
+                candidates = [chunk for chunk in candidates if chunk_tobe_matched <= chunk] #variables bound on the way are kept in chunk_tobe_matched
+            else:
+                pattern = chunks.Pattern(chunk_tobe_matched)
+                candidates = [chunk for chunk in candidates if pattern.match(chunk, {}) is not None]
+            A_pm = [0] * len(candidates)
+        if not candidates:
+            return None, None
+
+        times, offsets = self.dm.times(candidates)
+        A_bll, defined = utilities.baselevel_learning_batch(time, times, offsets, model_parameters["baselevel_learning"], model_parameters["decay"], [self.dm.activations.get(chunk) for chunk in candidates], optimized_learning=model_parameters["optimized_learning"], dropped=self.dm.dropped(candidates)) #bll
+        if not defined.all(): #chunks without any activation are skipped
+            candidates = [chunk for chunk, keep in zip(candidates, defined) if keep]
+            A_pm = [pm for pm, keep in zip(A_pm, defined) if keep] if isinstance(A_pm, list) else A_pm[defined]
+            A_bll = A_bll[defined]
+            if not candidates:
+                return None, None
+        if np.isnan(A_bll).any():
+            raise utilities.ACTRError("The following chunk cannot receive base activation: %s. The reason is that one of its traces did not appear in a past moment." % candidates[np.flatnonzero(np.isnan(A_bll))[0]])
+        sources = utilities.spreading_sources(buffers, model_parameters["buffer_spreading_activation"], model_parameters["association_only_from_chunks"]) #sources do not depend on candidates, so they are collected once
+        A_sa = self.dm.spreading_activation(candidates, sources, model_parameters["strength_of_association"], model_parameters["spreading_activation_restricted"])
+        inst_noise = utilities.calculate_instantaneous_noise(model_parameters["instantaneous_noise"], len(candidates))
+        A = A_bll + A_sa + np.array(A_pm, dtype=float) + inst_noise #chunk.activation is the manually specified activation, potentially used by the modeller
+
+        successful = np.flatnonzero(A >= model_parameters["retrieval_threshold"])
+        if len(successful) == 0:
+            return None, None
+        if model_parameters["activation_trace"]:
+            max_A = float("-inf")
+            for idx in successful:
+                if max_A < A[idx]:
+                    max_A = A[idx]
+                    print("(Partially) matching chunk:", candidates[idx])
+                    print("Base level learning:", float(A_bll[idx]))
+                    print("Spreading activation", float(A_sa[idx]))
+                    print("Partial matching", float(A_pm[idx]))
+                    print("Noise:", inst_noise[idx] if model_parameters["instantaneous_noise"] else 0)
+                    print("Total activation", A[idx])
+                    print("Time to retrieve", utilities.retrieval_latency(A[idx], model_parameters["latency_factor"],  model_parameters["latency_exponent"]))
+        best = successful[np.argmax(A[successful])] #the first chunk with the highest activation
+        self.activation = A[best]
+        return candidates[best], utilities.retrieval_latency(A[best], model_parameters["latency_factor"],  model_parameters["latency_exponent"])
+
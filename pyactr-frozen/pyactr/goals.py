@@ -93,11 +93,11 @@ class Goal(buffers.Buffer):
         Create (aka set) a chunk in goal buffer.
         """
         try:
-            mod_attr_val = {x[0]: utilities.check_bound_vars(actrvariables, x[1]) for x in otherchunk.removeunused()} #creates dict of attr-val pairs according to otherchunk
+            mod_attr_val = chunks.Template.compile(otherchunk).fill(actrvariables) #creates dict of attr-val pairs according to otherchunk
         except utilities.ACTRError as arg:
             raise utilities.ACTRError("Setting the buffer using the chunk '%s' is impossible; %s" % (otherchunk, arg))
 
-        new_chunk = chunks.Chunk(otherchunk.typename, **mod_attr_val) #creates new chunk
+        new_chunk = chunks.Chunk.build(otherchunk.typename, mod_attr_val) #creates new chunk
 
         self.add(new_chunk, 0, harvest) #put chunk using add
 
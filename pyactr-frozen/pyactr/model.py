@@ -40,9 +40,12 @@ class ACTRModel(object):
     "utility_noise": 0,
     "utility_learning": False,
     "utility_alpha": 0.2,
+    "utility_horizon": None,
     "motor_prepared": False,
     "strict_harvesting": False,
     "production_compilation": False,
+    "lhs_profiling": False,
+    "selection_cache": 0,
     "automatic_visual_search": True,
     "emma": True,
     "emma_noise": True,
@@ -51,6 +54,14 @@ class ACTRModel(object):
     "eye_mvt_scaling_parameter": 0.01
     }
 
+    optimized_learning can be False (exact base-level learning), True or 1 (optimized learning) or an integer k > 1 (hybrid optimized learning: the k most recent presentations are calculated exactly, older ones are approximated from their number and the first presentation). Declarative memory keeps all presentations; to store only the most recent ones (along with the number and the first time of the older ones), set history of the declarative memory, e.g., model.decmem.history = k. This is permanent: exact base-level learning or a larger k would then be calculated from the truncated presentations.
+
+    utility_horizon can be None or a number of seconds; in the latter case, rule firings that happened more than utility_horizon seconds before a reward do not get the reward.
+
+    lhs_profiling collects failure statistics of LHS conditions in conflict resolution and uses them to test conditions that fail most often first; the statistics are returned by condition_statistics.
+
+    selection_cache is the size of an LRU cache storing which rule was selected for given contents and states of buffers (0 means no cache). It is used only if there is no utility noise. Hits and misses are returned by selection_cache_info.
+
     environment has to be an instantiation of the class Environment.
     """
 
@@ -73,9 +84,12 @@ class ACTRModel(object):
                 "utility_noise": 0,
                 "utility_learning": False,
                 "utility_alpha": 0.2,
+                "utility_horizon": None,
                 "motor_prepared": False,
                 "strict_harvesting": False,
                 "production_compilation": False,
+                "lhs_profiling": False,
+                "selection_cache": 0,
                 "automatic_visual_search": True,
                 "emma": True,
                 "emma_noise": True,
@@ -105,7 +119,7 @@ class ACTRModel(object):
         self.decmems = {"decmem": start_dm}
 
         self.__productions = productions.Productions()
-        self.__similarities = {}
+        self.__similarities = declarative.SimilarityMatrix()
 
         self.model_parameters = self.MODEL_PARAMETERS.copy()
 
@@ -222,9 +236,8 @@ class ACTRModel(object):
             productions.Productions._undefinedrulecounter += 1
         temp_dictRHS = {v: k for k, v in utilities._RHSCONVENTIONS.items()}
         temp_dictLHS = {v: k for k, v in utilities._LHSCONVENTIONS.items()}
-        rule_reader = utilities.getrule()
         try:
-            rule = rule_reader.parseString(string, parseAll=True)
+            rule = utilities.parserule(string)
         except pyparsing.ParseException as e:
             raise(utilities.ACTRError("The rule '%s' could not be parsed. The following error was observed: %s" %(name, e)))
         lhs, rhs = {}, {}
@@ -256,6 +269,18 @@ class ACTRModel(object):
         self.__productions.update({name: {"rule": func, "utility": utility, "reward": reward}})
         return self.__productions[name]
 
+    def condition_statistics(self):
+        """
+        Failure statistics of LHS conditions in the last simulation, collected if lhs_profiling is True. See ProductionRules.condition_statistics.
+        """
+        return self.used_productions.condition_statistics()
+
+    def selection_cache_info(self):
+        """
+        Hits and misses of the cache of rule selections in the last simulation, along with its size. See ProductionRules.selection_cache_info.
+        """
+        return self.used_productions.selection_cache_info()
+
     def set_similarities(self, chunk, otherchunk, value):
         """
         Set similarities between chunks. By default, different chunks have the value of -1.
@@ -267,7 +292,7 @@ class ACTRModel(object):
         self.__similarities[tuple((chunk, otherchunk))] = value
         self.__similarities[tuple((otherchunk, chunk))] = value
 
-    def simulation(self, realtime=False, trace=True, gui=True, initial_time=0, environment_process=None, **kwargs):
+    def simulation(self, realtime=False, trace=True, gui=True, initial_time=0, environment_process=None, scheduler="simpy", **kwargs):
         """
         Prepare simulation of the model
 
@@ -279,6 +304,7 @@ class ACTRModel(object):
         initial_time - what is the starting time point of the simulation?
         environment_process - what environment process should the simulation use?
         The last argument should be supplied with the method environment_process of the environment used in the model.
+        scheduler - which event loop should run the simulation? Either "simpy" (default) or "native" (the heap-based scheduler in pyactr.scheduler, which produces the same trace with less overhead).
         kwargs are arguments that environment_process will be supplied with.
         """
 
@@ -308,4 +334,4 @@ class ACTRModel(object):
 
         chunks.Chunk._similarities = self.__similarities
 
-        return simulation.Simulation(self.__env, realtime, trace, gui, self.__buffers, self.used_productions, initial_time, environment_process, **kwargs)
+        return simulation.Simulation(self.__env, realtime, trace, gui, self.__buffers, self.used_productions, initial_time, environment_process, scheduler=scheduler, **kwargs)
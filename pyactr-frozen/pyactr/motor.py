@@ -51,11 +51,11 @@ class Motor(buffers.Buffer):
         if actrvariables == None:
             actrvariables = {}
         try:
-            mod_attr_val = {x[0]: utilities.check_bound_vars(actrvariables, x[1]) for x in otherchunk.removeunused()} #creates dict of attr-val pairs according to otherchunk
+            mod_attr_val = chunks.Template.compile(otherchunk).fill(actrvariables) #creates dict of attr-val pairs according to otherchunk
         except ACTRError as arg:
             raise ACTRError("Setting the chunk '%s' in the manual buffer is impossible; %s" % (otherchunk, arg))
 
-        new_chunk = chunks.Chunk(self._MANUAL, **mod_attr_val) #creates new chunk
+        new_chunk = chunks.Chunk.build(self._MANUAL, mod_attr_val) #creates new chunk
 
         if new_chunk.cmd.values not in utilities.CMDMANUAL:
             raise ACTRError("Motor module received an invalid command: '%s'. The valid commands are: '%s'" % (new_chunk.cmd.values, utilities.CMDMANUAL))
@@ -2,8 +2,14 @@
 Production rules.
 """
 
+import bisect
 import collections
 import inspect
+import itertools
+import types
+import weakref
+
+import numpy as np
 
 import pyactr.declarative as declarative
 import pyactr.chunks as chunks
@@ -17,6 +23,8 @@ Event = utilities.Event
 
 roundtime = utilities.roundtime
 
+CompiledRule = collections.namedtuple("CompiledRule", "name, rule, lhs, rhs, tests, selection, movable, actions, updated") #rule compiled by Productions.compiled
+
 #TODO: production compilation -- in ProductionRules - currently slotvals ignore that maybe there was other modification to the buffer in the same RHS of the rule, this should be included
 
 class Production(collections.UserDict):
@@ -33,6 +41,9 @@ class Production(collections.UserDict):
         self.utility = utility
         self.reward = reward
 
+        self.compiled = None #the rule compiled by Productions.compiled
+        self.queues = weakref.WeakKeyDictionary() #RuleQueues ordering the production, along with the rulename used in them
+
     def __contains__(self, elem):
         return elem in self.rule
 
@@ -64,6 +75,75 @@ class Production(collections.UserDict):
     def __setitem__(self, key, value):
         assert key in {"rule", "utility", "reward"}, "The production can set only one of four values -- rule, utility, reward; you are using '%s'" %key
         self.rule[key] = value
+        for queue, rulename in list(self.queues.items()):
+            if key == "utility":
+                queue.update(rulename)
+            elif key == "rule":
+                queue.changed.add(rulename)
+                queue.version += 1 #the order stays, but what depends on rules has to be recalculated
+
+class RuleQueue(object):
+    """
+    Rulenames ordered by utilities, the highest utility first; rules with the same utility are ordered as they were added. The order is kept when utilities of rules change (productions notify queues) and when rules are added; each change takes O(log n) comparisons.
+
+    Rules that were added or whose rule functions changed since the last check are collected in changed; whoever depends on rule functions empties it after catching up.
+
+    rules are Productions in which rulenames are looked up.
+    """
+
+    def __init__(self, rules, rulenames=()):
+        self.rules = rules
+        self.version = 0 #changes whenever the order changes
+        self.changed = set() #rulenames added or with a new rule function, see ProductionRules.failing_rules
+        self.__keys = [] #sorted list of (-utility, counter, rulename)
+        self.__positions = {} #rulename -> its key in self.__keys
+        self.__counter = itertools.count()
+        for rulename in rulenames:
+            self.append(rulename)
+
+    def __iter__(self):
+        for key in self.__keys:
+            yield key[2]
+
+    def __len__(self):
+        return len(self.__keys)
+
+    def __contains__(self, rulename):
+        return rulename in self.__positions
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def append(self, rulename):
+        """
+        Add a rule to the queue. If the rule is already present, its position is updated (the production might have been replaced).
+        """
+        production = self.rules[rulename]
+        if production is not None:
+            production.queues[self] = rulename
+        self.changed.add(rulename)
+        if rulename in self.__positions:
+            self.update(rulename)
+            self.version += 1 #the production might have a new rule function
+        else:
+            key = (-production["utility"], next(self.__counter), rulename)
+            bisect.insort(self.__keys, key)
+            self.__positions[rulename] = key
+            self.version += 1
+
+    def update(self, rulename):
+        """
+        Move the rule to the position given by its current utility.
+        """
+        production = self.rules[rulename]
+        old_key = self.__positions[rulename]
+        if production is None or -production["utility"] == old_key[0]:
+            return #removed rules stay where they were
+        del self.__keys[bisect.bisect_left(self.__keys, old_key)]
+        key = (-production["utility"], old_key[1], rulename)
+        bisect.insort(self.__keys, key)
+        self.__positions[rulename] = key
+        self.version += 1
 
 class Productions(collections.UserDict):
     """
@@ -74,6 +154,8 @@ class Productions(collections.UserDict):
 
     __DFT_UTILITY = 0
     __DFT_REWARD = None
+
+    _ORDERING = {"!": 0, "?": 0, "=": 1, "@": 2, "*": 3, "+": 4, "~": 5} #order in which RHS actions are carried out
         
     def __init__(self, *rules):
         self.rules = {}
@@ -92,7 +174,11 @@ class Productions(collections.UserDict):
                 reward = inspect.getargspec(rule).defaults[0-reward_position]
             self.update({rule.__name__: {'rule': rule, 'utility': utility, 'reward': reward}})
 
-        self.used_rulenames = {} #the dictionary of used rulenames, needed for utility learning
+        self.used_rulenames = {} #the dictionary of used rulenames, needed for utility learning; replaced by RuleFirings in simulations
+
+        self.__structures = {} #rulenames of compiled rules along with structures of the rules -> names of rules, see compile_rules
+        self.__structured = {} #names of compiled rules -> production, along with its structure
+        self.__rejected = set() #pairs of rules (along with rule functions and buffer types) for which compilation is unsafe
 
     def __contains__(self, elem):
         return elem in self.rules
@@ -117,10 +203,54 @@ class Productions(collections.UserDict):
         return txt
 
     def __setitem__(self, key, value):
+        replaced = self.rules.get(key)
         if isinstance(value, collections.MutableMapping):
             self.rules[key] = Production(**value)
         else:
             self.rules[key] = Production(rule=value["rule"], utility=self.__DFT_UTILITY, reward=self.__DFT_REWARD)
+        if replaced is not None:
+            for queue, rulename in list(replaced.queues.items()):
+                queue.append(rulename) #queues ordering the replaced production follow the new one
+
+    def compiled(self, rulename):
+        """
+        Return the rule compiled into CompiledRule, which is used in simulations. The rule function is called only once: LHS tests are split into codes, buffers and compiled patterns, RHS actions are sorted in the order in which they are carried out and updated stores the buffers changed in RHS. The compiled rule is kept until the rule function of the production is changed.
+
+        selection orders LHS tests for conflict resolution: queries come first, then tests without variables, then the rest in the order of LHS. The first movable conditions of selection (queries and tests without variables) do not depend on variable bindings and can be tested in any order.
+
+        Errors in RHS are stored in actions and raised only when the rule fires.
+        """
+        production = self.rules[rulename]
+        rule = production["rule"]
+        if production.compiled is not None and production.compiled.rule is rule:
+            return production.compiled
+        generator = rule()
+        lhs = types.MappingProxyType(dict(next(generator))) #copied, since rules might yield the same dicts on every call
+        tests = tuple((key[0], key[1:], chunks.Pattern.compile(value) if key[0] == "=" and isinstance(value, chunks.Chunk) else value) for key, value in lhs.items())
+        try:
+            rhs = types.MappingProxyType(dict(next(generator)))
+        except ACTRError as e:
+            rhs, actions, updated = None, e, frozenset()
+        except StopIteration:
+            rhs, actions, updated = None, ACTRError("The rule '%s' has no RHS" % rulename), frozenset()
+        else:
+            actions, updated = self.rhs_actions(rulename, rhs)
+        queries = [test for test in tests if test[0] == "?"]
+        constants = [test for test in tests if test[0] == "=" and isinstance(test[2], chunks.Pattern) and not isinstance(test[2].chunk, chunks.PatternChunk)]
+        selection = tuple(queries + constants + [test for test in tests if test not in queries and test not in constants])
+        production.compiled = CompiledRule(rulename, rule, lhs, rhs, tests, selection, len(queries) + len(constants), actions, updated)
+        return production.compiled
+
+    @classmethod
+    def rhs_actions(cls, rulename, rhs):
+        """
+        Return RHS actions as (code, buffer, value) sorted in the order in which they are carried out, along with the set of buffers used in RHS. If RHS is invalid, the error is returned instead of actions.
+        """
+        try:
+            actions = tuple((key[0], key[1:], rhs[key]) for key in sorted(rhs, key=lambda x: cls._ORDERING[x[0]]))
+        except KeyError:
+            actions = ACTRError("The RHS rule '%s' is invalid; every condition in RHS rules must start with one of these signs: %s" % (rulename, list(utilities._RHSCONVENTIONS.keys())))
+        return actions, frozenset(key[1:] for key in rhs)
 
     def __collapse__(self, rule1, rule2, slotvals, retrieval):
         """
@@ -377,14 +507,33 @@ class Productions(collections.UserDict):
 
         return False
 
+    @staticmethod
+    def structure(production):
+        """
+        Return a hashable structure of the production, i.e., its LHS and RHS. Productions have equal structures iff their LHS and RHS are equal. None is returned if some parts of the production are not hashable.
+        """
+        generator = production["rule"]()
+        try:
+            structure = tuple(frozenset((key, frozenset(value.items()) if isinstance(value, dict) else value) for key, value in next(generator).items()) for _ in range(2))
+            hash(structure)
+        except TypeError:
+            return None
+        return structure
+
     def compile_rules(self, rule_name1, rule_name2, slotvals, buffers, model_parameters):
         """
         Rule compilation.
+
+        Pairs of rules whose compilation is unsafe are remembered and not checked again (unless the rules change). Compiled rules are indexed by their structure, so that re-created rules are found without comparing them to every rule of the same name.
         """
         slotvals = slotvals.copy()
 
+        pair = rule_name1, self[rule_name1]['rule'], rule_name2, self[rule_name2]['rule'], frozenset((name, type(buffers[name])) for name in buffers)
+        if pair in self.__rejected:
+            return False, False
         stop = self.__check_valid_compilation__(rule_name1, rule_name2, buffers)
         if stop:
+            self.__rejected.add(pair)
             return False, False
 
         #we have to get rid of =, ~= sign
@@ -428,26 +577,34 @@ class Productions(collections.UserDict):
 
         new_rule = self.__collapse__(new_1rule, new_2rule, slotvals, retrieval)
         
-        idx = 0
-        re_created = "CREATED"
-        while True:
-            if idx > 0:
-                new_name = " ".join([str(rule_name1), "and", str(rule_name2), str(idx)])
-            else:
-                new_name = " ".join([str(rule_name1), "and", str(rule_name2)])
-            if self.__getitem__(new_name):
-                pr1 = self[new_name]["rule"]()
-                pr2 = new_rule["rule"]()
-                if next(pr1) == next(pr2) and next(pr1) == next(pr2):
-                    re_created = "RE-CREATED"
-                    if model_parameters["utility_learning"]:
-                        self[new_name]["utility"] = round(self[new_name]["utility"] + model_parameters["utility_alpha"]*(self[rule_name1]["utility"]-self[new_name]["utility"]), 4)
-                    break
+        structure = self.structure(new_rule)
+        new_name = self.__structures.get((rule_name1, rule_name2, structure))
+        if structure is None or not new_name or self.__structured.get(new_name, (None,))[0] is not self.__getitem__(new_name):
+            idx = 0
+            while True:
+                if idx > 0:
+                    new_name = " ".join([str(rule_name1), "and", str(rule_name2), str(idx)])
                 else:
-                    idx += 1
-            else:
-                self[new_name] = new_rule
-                break
+                    new_name = " ".join([str(rule_name1), "and", str(rule_name2)])
+                production = self.__getitem__(new_name)
+                if not production:
+                    break
+                if structure is None or self.__structured.get(new_name, (None,))[0] is not production:
+                    pr1 = production["rule"]()
+                    pr2 = new_rule["rule"]()
+                    if next(pr1) == next(pr2) and next(pr1) == next(pr2):
+                        break
+                idx += 1 #rules indexed by structure differ, otherwise they would have been found
+        if self.__getitem__(new_name):
+            re_created = "RE-CREATED"
+            if model_parameters["utility_learning"]:
+                self[new_name]["utility"] = round(self[new_name]["utility"] + model_parameters["utility_alpha"]*(self[rule_name1]["utility"]-self[new_name]["utility"]), 4)
+        else:
+            re_created = "CREATED"
+            self[new_name] = new_rule
+            if structure is not None:
+                self.__structures[(rule_name1, rule_name2, structure)] = new_name
+                self.__structured[new_name] = self[new_name], structure
 
         return new_name, re_created
 
@@ -463,10 +620,19 @@ class ProductionRules(object):
     _LHSCONVENTIONS = utilities._LHSCONVENTIONS
     _INTERRUPTIBLE = utilities._INTERRUPTIBLE
 
+    _PROFILING_PERIOD = 64 #how often the order of LHS tests is recalculated when lhs_profiling is on
+
+    _DISPATCH_SIZE = 1024 #how many contents of goal buffers keep their candidate rules, see failing_rules
+
     def __init__(self, rules, buffers, dm, model_parameters):
         self.__actrvariables = {} #variables in a fired rule
         self.rules = rules
-        self.ordered_rulenames = sorted(rules.keys(), key=lambda x: rules[x]['utility'], reverse=True) #rulenames ordered by utilities -- this speeds up rule selection when utilities are used
+        used_rulenames = rules.used_rulenames
+        if not isinstance(used_rulenames, utilities.RuleFirings) or (used_rulenames.alpha, used_rulenames.horizon) != (model_parameters["utility_alpha"], model_parameters["utility_horizon"]):
+            if isinstance(used_rulenames, utilities.RuleFirings):
+                used_rulenames = {} #running sums cannot be recalculated for new parameters
+            rules.used_rulenames = utilities.RuleFirings(model_parameters["utility_alpha"], model_parameters["utility_horizon"], used_rulenames)
+        self.ordered_rulenames = RuleQueue(rules, rules.keys()) #rulenames ordered by utilities -- this speeds up rule selection when utilities are used
 
         self.last_rule = None #used for production compilation
         self.last_rule_slotvals = {key: None for key in buffers} #slot-values after a production; used for production compilation
@@ -475,7 +641,7 @@ class ProductionRules(object):
 
         self.buffers = buffers #dict of buffers
 
-        self.procs = [] #list of active processes
+        self.procs = [] #list of processes started by the current rule
 
         self.dm = dm #list of (submodules of) memories
 
@@ -483,64 +649,65 @@ class ProductionRules(object):
 
         self.model_parameters = model_parameters
 
+        self.__network = {} #rulenames -> constant tests of the rule, see constant_tests
+        self.__index = {} #buffers -> slots -> constant values -> rulenames testing the value in the slot of the buffer
+        self.__tested = {} #buffers -> rulenames testing the buffer -> number of constant tests on the buffer
+        self.__failing = {} #buffers other than goals -> chunk in the buffer, along with rulenames whose tests on the buffer fail for that chunk
+        self.__dispatch = collections.OrderedDict() #chunks in goal buffers -> rulenames whose constant tests on goal buffers agree with the chunks (ordered as in ordered_rulenames), along with the rest of rulenames
+        self.__dispatch_version = self.ordered_rulenames.version #version of ordered_rulenames used in self.__dispatch
+        self.__candidates = () #candidate rules found by the last call of failing_rules
+
+        self.__selections = collections.OrderedDict() #fingerprints of buffers -> selected rulenames, see selection
+        self.__fingerprinted = None, None #version of rules, along with buffers and their queried states used in fingerprints
+        self.__cache_info = {"hits": 0, "misses": 0}
+
+        self.__statistics = {} #rulenames -> LHS conditions -> number of tests and failures, collected if lhs_profiling is True
+        self.__orders = {} #rulenames -> compiled rule, order of its LHS tests learned from failures, number of tests before the order is recalculated
+
     def procedural_process(self, start_time=0):
         """
         Process that is carrying a production. Proceeds in steps: conflict resolution -> rule selection -> rule firing; or conflict resolution -> no rule found. Start_time specifies when production starts in discrete event simulation.
         """
         time = start_time
 
-        self.procs.append(self._PROCEDURAL,)
+        self.procs = [self._PROCEDURAL] #a new list in every cycle; processes not yet picked up by modules wait in the queues of Simulation
         
         self.__actrvariables = {}
         yield Event(roundtime(time), self._PROCEDURAL, 'CONFLICT RESOLUTION')
 
-        max_utility = float("-inf")
         used_rulename = None
         self.used_rulename = None
         self.extra_tests = {}
         
         self.last_rule_slotvals = self.current_slotvals.copy()
 
-        for rulename in self.ordered_rulenames:
-            self.used_rulename = rulename
-            production = self.rules[rulename]["rule"]()
-            utility = self.rules[rulename]["utility"]
-
-            pro = next(production)
-
-            if self.model_parameters["subsymbolic"]:
-                inst_noise = utilities.calculate_instantaneous_noise(self.model_parameters["utility_noise"])
-                utility += inst_noise
-            if max_utility <= utility and self.LHStest(pro, self.__actrvariables.copy()):
-                max_utility = utility
-                used_rulename = rulename
-                if not self.model_parameters["subsymbolic"] or not self.model_parameters["utility_noise"]:
-                    break #breaking after finding a rule, to speed up the process
+        if self.model_parameters["subsymbolic"] and self.model_parameters["utility_noise"]:
+            used_rulename = self.noisy_selection(self.failing_rules())
+        else:
+            used_rulename = self.selection()
         if used_rulename:
             self.used_rulename = used_rulename
-            production = self.rules[used_rulename]["rule"]()
-            self.rules.used_rulenames.setdefault(used_rulename, []).append(time)
+            production = self.rules.compiled(used_rulename)
+            self.rules.used_rulenames.add(used_rulename, time)
             
-            yield Event(roundtime(time), self._PROCEDURAL, 'RULE SELECTED: %s' % used_rulename)
+            yield Event(roundtime(time), self._PROCEDURAL, utilities.RULE_SELECTED, (used_rulename,))
             time = time + self.model_parameters["rule_firing"]
             yield Event(roundtime(time), self._PROCEDURAL, self._UNKNOWN)
 
-            pro = next(production)
-
-            if not self.LHStest(pro, self.__actrvariables.copy(), True):
-                yield Event(roundtime(time), self._PROCEDURAL, 'RULE STOPPED FROM FIRING: %s' % used_rulename)
+            if not self.LHStest(production, self.__actrvariables.copy(), True):
+                yield Event(roundtime(time), self._PROCEDURAL, utilities.RULE_STOPPED, (used_rulename,))
             else:
                 if self.model_parameters["utility_learning"] and self.rules[used_rulename]["reward"] != None:
                     utilities.modify_utilities(time, self.rules[used_rulename]["reward"], self.rules.used_rulenames, self.rules, self.model_parameters)
-                    self.rules.used_rulenames = {}
+                    self.rules.used_rulenames.clear()
                 compiled_rulename, re_created = self.compile_rules()
                 self.compile = []
                 if re_created:
-                    yield Event(roundtime(time), self._PROCEDURAL, 'RULE %s: %s' % (re_created, compiled_rulename))
+                    yield Event(roundtime(time), self._PROCEDURAL, utilities.RULE_COMPILED, (re_created, compiled_rulename))
                 self.current_slotvals = {key: None for key in self.buffers}
-                yield Event(roundtime(time), self._PROCEDURAL, 'RULE FIRED: %s' % used_rulename)
+                yield Event(roundtime(time), self._PROCEDURAL, utilities.RULE_FIRED, (used_rulename,))
                 try:
-                    yield from self.update(next(production), time)
+                    yield from self.update(production, time)
                 except utilities.ACTRError as e:
                     raise utilities.ACTRError("The following rule is not defined correctly according to ACT-R: '%s'. The following error occurred: %s" % (self.used_rulename, e))
                 if self.last_rule and self.last_rule != used_rulename:
@@ -567,25 +734,18 @@ class ProductionRules(object):
 
     def update(self, RHSdictionary, time):
         """
-        Update buffers (RHS of production rules).
+        Update buffers (RHS of production rules). RHSdictionary is RHS of a rule, or the rule compiled by Productions.compiled.
         """
-        temp_actrvariables = dict(self.__actrvariables)
-        ordering_dict = {"!": 0, "?": 0, "=": 1, "@": 2, "*": 3, "+": 4, "~": 5}
-        try:
-            dictionary = collections.OrderedDict.fromkeys(sorted(RHSdictionary, key=lambda x:ordering_dict[x[0]]))
-        except KeyError:
-            raise ACTRError("The RHS rule '%s' is invalid; every condition in RHS rules must start with one of these signs: %s" % (self.used_rulename, list(self._RHSCONVENTIONS.keys())))
-        dictionary.update(RHSdictionary)
-        for key in dictionary:
-            submodule_name = key[1:] #this is the name of updated submodule
-            code = key[0] #this is what the key should do
-            
-            try:
-                temp_actrvariables.pop("=" + submodule_name) #pop used submodule (needed for strict harvesting)
-            except KeyError:
-                pass
+        if isinstance(RHSdictionary, CompiledRule):
+            actions, harvested = RHSdictionary.actions, RHSdictionary.updated
+        else:
+            actions, harvested = Productions.rhs_actions(self.used_rulename, RHSdictionary)
+        if isinstance(actions, ACTRError):
+            raise ACTRError(*actions.args)
+        temp_actrvariables = list(self.__actrvariables)
+        for code, submodule_name, value in actions:
             updated = self.buffers[submodule_name]
-            production = getattr(self, self._RHSCONVENTIONS[code])(submodule_name, updated, dictionary[key], self.__actrvariables, time)
+            production = getattr(self, self._RHSCONVENTIONS[code])(submodule_name, updated, value, self.__actrvariables, time)
 
             updated.state = updated._BUSY
 
@@ -598,7 +758,7 @@ class ProductionRules(object):
         if self.model_parameters["strict_harvesting"]:
             for key in temp_actrvariables:
                 submodule_name = key[1:]
-                if submodule_name in self.buffers:
+                if submodule_name in self.buffers and (key[0] != "=" or submodule_name not in harvested): #buffers used in RHS are not harvested
                     self.procs.append((submodule_name, self.clear(submodule_name, self.buffers[submodule_name], None, self.__actrvariables, time)))
 
     def extra_test(self, name, tested, test, temp_actrvariables, time):
@@ -652,10 +812,9 @@ class ProductionRules(object):
         if self.model_parameters['production_compilation']:
             RHSdict = otherchunk._asdict()
             RHSdict = {item[0]: item[1] for item in RHSdict.items() if item[1] != chunks.Chunk.EmptyValue()} #delete None values, they will be copied from LHSdict
-            production = self.rules[self.used_rulename]["rule"]()
             code = utilities._LHSCONVENTIONS_REVERSED["test"]
             try:
-                slotvaldict = next(production)[code+name]._asdict()
+                slotvaldict = self.rules.compiled(self.used_rulename).lhs[code+name]._asdict()
             except KeyError:
                 slotvaldict = {}
             finally:
@@ -677,10 +836,9 @@ class ProductionRules(object):
         if self.model_parameters['production_compilation']:
             RHSdict = otherchunk._asdict()
             RHSdict = {item[0]: item[1] for item in RHSdict.items() if item[1] != chunks.Chunk.EmptyValue()} #delete None values, they will be copied from LHSdict
-            production = self.rules[self.used_rulename]["rule"]()
             code = utilities._LHSCONVENTIONS_REVERSED["test"]
             try:
-                slotvaldict = next(production)[code+name]._asdict()
+                slotvaldict = self.rules.compiled(self.used_rulename).lhs[code+name]._asdict()
             except KeyError:
                 slotvaldict = {}
             finally:
@@ -708,7 +866,7 @@ class ProductionRules(object):
 
         created_elem = list(updated)[0]
         updated.state = updated._FREE
-        yield Event(roundtime(time), name, "WROTE A CHUNK: %s" % str(created_elem))
+        yield Event(roundtime(time), name, utilities.WROTE_CHUNK, (created_elem,))
 
     def visualencode(self, name, visualbuffer, chunk, temp_actrvariables, time, extra_time, site):
         """
@@ -720,7 +878,7 @@ class ProductionRules(object):
         yield from self.clear(name, visualbuffer, None, temp_actrvariables, time, freeing=False)
         visualbuffer.add(chunk, time)
         visualbuffer.state = visualbuffer._FREE
-        yield Event(roundtime(time), name, "ENCODED VIS OBJECT:'%s'" % str(chunk))
+        yield Event(roundtime(time), name, utilities.ENCODED_VIS_OBJECT, (chunk,))
 
     def retrieveorset(self, name, updated, otherchunk, temp_actrvariables, time):
         """
@@ -740,7 +898,7 @@ class ProductionRules(object):
             updated.create(otherchunk, list(self.dm.values())[0], temp_actrvariables)
             created_elem = list(updated)[0]
             updated.state = updated._FREE
-            yield Event(roundtime(time), name, "CREATED A CHUNK: %s" % str(created_elem))
+            yield Event(roundtime(time), name, utilities.CREATED_CHUNK, (created_elem,))
         elif isinstance(updated, vision.VisualLocation):
             extra_time = utilities.calculate_setting_time(updated)
             time += extra_time #0 ms to create chunk in location (pop-up effect)
@@ -752,7 +910,7 @@ class ProductionRules(object):
                 updated.state = updated._FREE
             else:
                 updated.state = updated._ERROR
-            yield Event(roundtime(time), name, "ENCODED LOCATION:'%s'" % str(chunk))
+            yield Event(roundtime(time), name, utilities.ENCODED_LOCATION_QUOTED, (chunk,))
         elif isinstance(updated, vision.Visual):
             mod_attr_val = {x[0]: utilities.check_bound_vars(temp_actrvariables, x[1]) for x in otherchunk.removeunused()}
             if (not mod_attr_val['cmd'].values) or mod_attr_val['cmd'].values not in utilities.CMDVISUAL:
@@ -791,7 +949,7 @@ class ProductionRules(object):
             RHSdict = {item[0]: item[1] for item in RHSdict.items() if item[1] != chunks.Chunk.EmptyValue()} #delete None values
             self.current_slotvals[name] = [RHSdict, retrieved_elem]
 
-        yield Event(roundtime(time), name, 'RETRIEVED: %s' % str(retrieved_elem))
+        yield Event(roundtime(time), name, utilities.RETRIEVED, (retrieved_elem,))
 
     def automatic_search(self, name, visualbuffer, stim, time):
         """
@@ -806,7 +964,7 @@ class ProductionRules(object):
                 visualbuffer.modify(newchunk, stim)
             else:
                 visualbuffer.add(newchunk, stim, time)
-            yield Event(roundtime(time), name, 'ENCODED LOCATION: %s' %newchunk)
+            yield Event(roundtime(time), name, utilities.ENCODED_LOCATION, (newchunk,))
         else:
             yield Event(roundtime(time), name, self._UNKNOWN)
 
@@ -833,7 +991,7 @@ class ProductionRules(object):
                 visualbuffer.modify(newchunk)
             else:
                 visualbuffer.add(newchunk, time)
-            yield Event(roundtime(time), name, 'AUTOMATIC BUFFERING: %s' % str(newchunk))
+            yield Event(roundtime(time), name, utilities.AUTOMATIC_BUFFERING, (newchunk,))
 
     def visualshift(self, name, visualbuffer, otherchunk, temp_actrvariables, time):
         """
@@ -882,7 +1040,7 @@ class ProductionRules(object):
 
         yield Event(roundtime(time), name, self._UNKNOWN)
         visualbuffer.move_eye(landing_site)
-        yield Event(roundtime(time), name, 'SHIFT COMPLETE TO POSITION: %s' % str(visualbuffer.current_focus))
+        yield Event(roundtime(time), name, utilities.SHIFT_COMPLETE, (str(visualbuffer.current_focus),)) #focus is rendered right away, since the eyes keep moving
         if encoding > preparation+execution:
             newchunk, extra_time, _ = visualbuffer.shift(otherchunk, actrvariables=temp_actrvariables, model_parameters=self.model_parameters)
             yield from self.visualencode(name, visualbuffer, otherchunk, temp_actrvariables, time, (1-((preparation+execution)/encoding))*extra_time[0], landing_site)
@@ -922,7 +1080,7 @@ class ProductionRules(object):
         motorbuffer.preparation = motorbuffer._BUSY
         motorbuffer.processor = motorbuffer._BUSY
 
-        yield Event(roundtime(time), name, 'COMMAND: %s' % str(newchunk.cmd))
+        yield Event(roundtime(time), name, utilities.COMMAND, (newchunk.cmd,))
         time += preparation
         
         yield Event(roundtime(time), name, 'PREPARATION COMPLETE')
@@ -956,7 +1114,7 @@ class ProductionRules(object):
         
         self.env_interaction.add(otherchunk.key.values)
 
-        yield Event(roundtime(time), name, 'KEY PRESSED: %s' % str(otherchunk.key))
+        yield Event(roundtime(time), name, utilities.KEY_PRESSED, (otherchunk.key,))
         
         time += movement_finish
 
@@ -967,16 +1125,225 @@ class ProductionRules(object):
         motorbuffer.execution = motorbuffer._FREE
         motorbuffer.last_key[1] = 0
 
+    def constant_tests(self, rulename):
+        """
+        Collect constant tests of the rule, i.e., slot values that buffers must carry for the rule to match. Return a dict of buffers and their tested slots and values.
+
+        Only tests that LHStest would carry out before anything else are collected (so that failing rules raise errors as before), and empty values are not used.
+        """
+        tests = {}
+        try:
+            compiled = self.rules.compiled(rulename)
+        except ACTRError:
+            return tests #the rule is incorrect, and conflict resolution will say so
+        for code, name, pattern in compiled.tests:
+            if code != "=" or not isinstance(pattern, chunks.Pattern):
+                break
+            slotvals = tests.setdefault(name, {})
+            for slot, _, _, value, _ in pattern.slots:
+                if value and value not in {chunks.Chunk.EmptyValue(), 'None'}:
+                    slotvals[slot] = value
+        return tests
+
+    def failing_rules(self):
+        """
+        Return the set of rules whose constant tests fail on the current content of buffers. These rules need not be tested in conflict resolution.
+
+        Constant tests are indexed by buffer, slot and value (a discrimination network), and results are reused for buffers whose chunk did not change since the last conflict resolution. Chunk types are ignored, since they are ignored in matching as well.
+
+        Rules that were added or got a new rule function are reported by ordered_rulenames (see RuleQueue.changed); only their entries in the network are replaced, and only buffers they test are evaluated anew.
+
+        Goal buffers (goal, imaginal etc.) usually carry a few recurring states, so they are evaluated together and the result is stored per their content (the last _DISPATCH_SIZE contents are kept): the rules failing on them, along with the remaining rules in the order of utilities, which are the candidates of conflict resolution (see candidate_rules).
+        """
+        changed = self.ordered_rulenames.changed
+        if changed:
+            for rulename in changed:
+                if self.rules[rulename] is not None: #rules that were removed are left as they are, conflict resolution takes care of them
+                    self.__renew_tests(rulename)
+            changed.clear()
+        if self.__dispatch_version != self.ordered_rulenames.version:
+            self.__dispatch.clear() #the version changes with the order and with rule functions
+            self.__dispatch_version = self.ordered_rulenames.version
+        names = [name for name in self.__tested if isinstance(self.buffers.get(name), goals.Goal)]
+        key = tuple(next(iter(self.buffers[name]), None) for name in names)
+        try:
+            self.__candidates, goal_failing = self.__dispatch[key]
+        except KeyError:
+            goal_failing = set()
+            for name, chunk in zip(names, key):
+                goal_failing.update(self.__buffer_failing(name, chunk))
+            self.__candidates = tuple(rulename for rulename in self.ordered_rulenames if rulename not in goal_failing)
+            self.__dispatch[key] = self.__candidates, goal_failing
+            if len(self.__dispatch) > self._DISPATCH_SIZE:
+                self.__dispatch.popitem(last=False)
+        else:
+            self.__dispatch.move_to_end(key)
+        failing = set(goal_failing)
+        for name in self.__tested:
+            if isinstance(self.buffers.get(name), goals.Goal):
+                continue
+            chunk = next(iter(self.buffers[name]), None) if name in self.buffers else None
+            try:
+                cached_chunk, cached_failing = self.__failing[name]
+            except KeyError:
+                pass
+            else:
+                if cached_chunk is chunk:
+                    failing.update(cached_failing)
+                    continue
+            buffer_failing = self.__buffer_failing(name, chunk)
+            self.__failing[name] = chunk, buffer_failing
+            failing.update(buffer_failing)
+        return failing
+
+    def __renew_tests(self, rulename):
+        """
+        Replace constant tests of the rule in the discrimination network and forget results of buffers tested before or now.
+        """
+        for name, slotvals in self.__network.pop(rulename, {}).items():
+            del self.__tested[name][rulename]
+            for slot, value in slotvals.items():
+                self.__index[name][slot][value].remove(rulename)
+            self.__failing.pop(name, None)
+        tests = self.constant_tests(rulename)
+        for name, slotvals in tests.items():
+            self.__tested.setdefault(name, {})[rulename] = len(slotvals)
+            for slot, value in slotvals.items():
+                self.__index.setdefault(name, {}).setdefault(slot, {}).setdefault(value, []).append(rulename)
+            self.__failing.pop(name, None)
+        self.__network[rulename] = tests
+
+    def __buffer_failing(self, name, chunk):
+        """
+        Return the set of rules whose constant tests on the buffer name fail for chunk.
+        """
+        tested = self.__tested.get(name, {})
+        if chunk is None:
+            return set(tested)
+        passed = collections.Counter()
+        for slot, values in self.__index.get(name, {}).items():
+            try:
+                matching_val = getattr(chunk.actrchunk, slot)
+            except AttributeError:
+                continue
+            if isinstance(matching_val, utilities.VarvalClass):
+                matching_val = matching_val.values
+            passed.update(values.get(matching_val, ()))
+        return {rulename for rulename, number in tested.items() if passed[rulename] < number}
+
+    def selection(self):
+        """
+        Select the first matching rule in the order of utilities (no utility noise is present). Return None if no rule matches.
+
+        If the model parameter selection_cache is a positive number, selected rules are stored in an LRU cache of that size. The key is a fingerprint of buffers: chunks in buffers tested or queried in LHS of rules, along with queried states. The cache is emptied when rules or utilities change. See selection_cache_info for hits and misses.
+        """
+        key = None
+        if self.model_parameters["selection_cache"]:
+            key = self.__fingerprint()
+            if key is not None:
+                try:
+                    used_rulename = self.__selections[key]
+                except KeyError:
+                    self.__cache_info["misses"] += 1
+                else:
+                    self.__selections.move_to_end(key)
+                    self.__cache_info["hits"] += 1
+                    return used_rulename
+        failing = self.failing_rules()
+        used_rulename = None
+        for rulename in self.candidate_rules(): #candidates pass constant tests on goal buffers, failing covers the other buffers
+            self.used_rulename = rulename
+            if rulename not in failing and self.LHStest(self.rules.compiled(rulename), self.__actrvariables.copy()):
+                used_rulename = rulename
+                break #rules are ordered by utilities, so the first matching rule is selected
+        if key is not None:
+            self.__selections[key] = used_rulename
+            if len(self.__selections) > self.model_parameters["selection_cache"]:
+                self.__selections.popitem(last=False)
+        return used_rulename
+
+    def __fingerprint(self):
+        """
+        Return the fingerprint of buffers that decides rule selection, or None if the fingerprint cannot be created (some rules are not correct).
+        """
+        version = self.ordered_rulenames.version, len(self.rules)
+        if self.__fingerprinted[0] != version:
+            self.__selections.clear()
+            try:
+                queried = {}
+                for rulename in self.ordered_rulenames:
+                    for code, name, value in self.rules.compiled(rulename).tests:
+                        attributes = queried.setdefault(name, set())
+                        if code == "?":
+                            attributes.update(x for x in value if x != "buffer")
+            except (ACTRError, KeyError):
+                queried = None
+            else:
+                queried = tuple((name, tuple(sorted(attributes))) for name, attributes in sorted(queried.items()))
+            self.__fingerprinted = version, queried
+        queried = self.__fingerprinted[1]
+        if queried is None:
+            return None
+        fingerprint = []
+        for name, attributes in queried:
+            buffer = self.buffers.get(name)
+            if buffer is None:
+                fingerprint.append(None)
+            else:
+                fingerprint.append(next(iter(buffer), None))
+                fingerprint.extend(getattr(buffer, attribute, None) for attribute in attributes)
+        return tuple(fingerprint)
+
+    def selection_cache_info(self):
+        """
+        Return hits and misses of the cache of rule selections, along with its current size.
+        """
+        return dict(self.__cache_info, size=len(self.__selections))
+
+    def noisy_selection(self, failing):
+        """
+        Select the matching rule with the highest utility after utility noise is added; if several rules have the highest utility, the one later in ordered_rulenames is selected. Return None if no rule matches.
+
+        Noise is drawn for all rules in one call, in the order of ordered_rulenames (so the random stream is the same as when drawn rule by rule). Rules are then tested in the descending order of their noisy utilities and the first matching rule is selected; rules that could not beat it are never tested.
+        """
+        rulenames = list(self.ordered_rulenames)
+        noisy_utilities = np.array([self.rules[rulename]["utility"] for rulename in rulenames], dtype=float) + utilities.calculate_instantaneous_noise(self.model_parameters["utility_noise"], len(rulenames))
+        for idx in np.lexsort((-np.arange(len(rulenames)), -noisy_utilities)):
+            rulename = rulenames[idx]
+            self.used_rulename = rulename
+            if rulename not in failing and self.LHStest(self.rules.compiled(rulename), self.__actrvariables.copy()):
+                return rulename
+        return None
+
+    def candidate_rules(self):
+        """
+        Return rulenames (ordered as in ordered_rulenames) whose constant tests on goal buffers (goal, imaginal etc.) agree with the content of these buffers at the last call of failing_rules. Rules without constant tests on goal buffers are always candidates.
+        """
+        return self.__candidates
+
     def LHStest(self, dictionary, actrvariables, update=False):
         """
-        Test rules in LHS of production rules. update specifies whether actrvariables should be updated (this does not happen when rules are tested, only when they are fired)
+        Test rules in LHS of production rules. dictionary is LHS of a rule, or the rule compiled by Productions.compiled. update specifies whether actrvariables should be updated (this does not happen when rules are tested, only when they are fired)
+
+        Compiled rules are tested in the order of their selection when actrvariables are not updated, or in the order learned from failures of conditions if the model parameter lhs_profiling is True (see condition_statistics). When actrvariables are updated, the order of LHS is used.
         """
-        for key in dictionary:
-            submodule_name = key[1:] #this is the module
-            code = key[0] #this is what the module should do; standardly, query, i.e., ?, or test, =
+        statistics = None
+        if not isinstance(dictionary, CompiledRule):
+            tests = ((key[0], key[1:], dictionary[key]) for key in dictionary)
+        elif update:
+            tests = dictionary.tests
+        elif self.model_parameters["lhs_profiling"]:
+            tests, statistics = self.__profiled_selection(dictionary)
+        else:
+            tests = dictionary.selection
+        for code, submodule_name, value in tests: #code is what the module should do; standardly, query, i.e., ?, or test, =
             if code not in self._LHSCONVENTIONS:
                 raise ACTRError("The LHS rule '%s' is invalid; every condition in LHS rules must start with one of these signs: %s" % (self.used_rulename, list(self._LHSCONVENTIONS.keys())))
-            result = getattr(self, self._LHSCONVENTIONS[code])(submodule_name, self.buffers.get(submodule_name), dictionary[key], actrvariables)
+            result = getattr(self, self._LHSCONVENTIONS[code])(submodule_name, self.buffers.get(submodule_name), value, actrvariables)
+            if statistics is not None:
+                counts = statistics[code + submodule_name]
+                counts[0] += 1
+                counts[1] += not result[0]
             if not result[0]:
                 return False
             else:
@@ -985,11 +1352,32 @@ class ProductionRules(object):
             self.__actrvariables = actrvariables
         return True
 
+    def __profiled_selection(self, compiled):
+        """
+        Return LHS tests of the compiled rule in the order learned from failures, along with failure statistics of the rule. Movable conditions (see Productions.compiled) are ordered by their failure rates, the highest first; the order is recalculated after every _PROFILING_PERIOD tests of the rule.
+        """
+        statistics = self.__statistics.setdefault(compiled.name, {})
+        for code, submodule_name, _ in compiled.tests:
+            statistics.setdefault(code + submodule_name, [0, 0])
+        cached, order, left = self.__orders.get(compiled.name, (None, None, 0))
+        if cached is not compiled or not left:
+            rate = lambda test: statistics[test[0] + test[1]][1]/max(statistics[test[0] + test[1]][0], 1)
+            order = tuple(sorted(compiled.selection[:compiled.movable], key=rate, reverse=True)) + compiled.selection[compiled.movable:]
+            left = self._PROFILING_PERIOD
+        self.__orders[compiled.name] = compiled, order, left - 1
+        return order, statistics
+
+    def condition_statistics(self):
+        """
+        Return failure statistics of LHS conditions, collected in conflict resolution when the model parameter lhs_profiling is True. The statistics are a dict of rulenames -> conditions (e.g., '=g' or '?retrieval') -> (number of tests, number of failures).
+        """
+        return {rulename: {condition: tuple(counts) for condition, counts in statistics.items()} for rulename, statistics in self.__statistics.items()}
+
     def test(self, submodule_name, tested, testchunk, temp_actrvariables):
         """
         Test the content of a buffer.
 
-        What buffer - specified by tested.
+        What buffer - specified by tested. testchunk can be a chunk or its compiled Pattern.
         """
         if not tested:
             return False, None
@@ -999,11 +1387,12 @@ class ProductionRules(object):
         if submodule_var in temp_actrvariables and list(self.buffers[submodule_name])[0] != temp_actrvariables[submodule_var]:
             return False, None
 
+        pattern = testchunk if isinstance(testchunk, chunks.Pattern) else chunks.Pattern.compile(testchunk)
         for chunk in tested:
-            testchunk.boundvars = dict(temp_actrvariables)
+            matched = pattern.match(chunk, temp_actrvariables)
 
-            if testchunk <= chunk:
-                temp_actrvariables = dict(testchunk.boundvars)
+            if matched is not None:
+                temp_actrvariables = matched
                 temp_actrvariables[submodule_var] = list(self.buffers[submodule_name])[0]
                 return True, temp_actrvariables
             else:
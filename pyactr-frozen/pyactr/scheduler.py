@@ -0,0 +1,415 @@
+"""
+Native discrete-event scheduler for ACT-R simulations.
+
+The scheduler is a drop-in alternative to simpy.Environment. It keeps simpy's ordering semantics (events are ordered by time, priority and creation order; processes start with urgent priority; interrupts are urgent) so that simulations produce the same trace, but it only implements what pyactr needs: processes, timeouts, plain events, interrupts and 'or' conditions, in simulated or real time.
+
+Both schedulers also offer schedule_triggered, which schedules an event with a priority of its own (simpy environments get it from SimpyEnvironment and SimpyRealtimeEnvironment).
+"""
+
+import heapq
+import itertools
+import time
+
+import simpy
+from simpy.core import EmptySchedule, Infinity
+from simpy.exceptions import Interrupt
+
+URGENT = 0
+NORMAL = 1
+
+_PENDING = object()
+
+class Event(object):
+    """
+    Event that can be yielded by processes. Once processed, callbacks are called with the event.
+    """
+
+    __slots__ = ("env", "callbacks", "_value", "_ok", "_defused")
+
+    def __init__(self, env):
+        self.env = env
+        self.callbacks = []
+        self._value = _PENDING
+        self._ok = True
+        self._defused = False
+
+    def __repr__(self):
+        return "<%s object at 0x%x>" % (self.__class__.__name__, id(self))
+
+    @property
+    def triggered(self):
+        """
+        True if the event has been triggered (it is scheduled or processed).
+        """
+        return self._value is not _PENDING
+
+    @property
+    def processed(self):
+        """
+        True if the callbacks of the event have been called.
+        """
+        return self.callbacks is None
+
+    @property
+    def ok(self):
+        """
+        True if the event has been triggered successfully.
+        """
+        return self._ok
+
+    @property
+    def value(self):
+        """
+        Value of the event, available once it is triggered.
+        """
+        if self._value is _PENDING:
+            raise AttributeError("Value of %s is not yet available" % self)
+        return self._value
+
+    def succeed(self, value=None):
+        """
+        Trigger the event with value and schedule it.
+        """
+        if self._value is not _PENDING:
+            raise RuntimeError("%s has already been triggered" % self)
+        self._ok = True
+        self._value = value
+        self.env.schedule(self)
+        return self
+
+    def fail(self, exception):
+        """
+        Trigger the event with exception and schedule it.
+        """
+        if self._value is not _PENDING:
+            raise RuntimeError("%s has already been triggered" % self)
+        if not isinstance(exception, BaseException):
+            raise TypeError("%s is not an exception." % exception)
+        self._ok = False
+        self._value = exception
+        self.env.schedule(self)
+        return self
+
+    def __or__(self, other):
+        return AnyOf(self.env, (self, other))
+
+class Timeout(Event):
+    """
+    Event that is processed after delay.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, env, delay, value=None):
+        if delay < 0:
+            raise ValueError("Negative delay %s" % delay)
+        self.env = env
+        self.callbacks = []
+        self._value = value
+        self._ok = True
+        self._defused = False
+        env.schedule(self, NORMAL, delay)
+
+class Process(Event):
+    """
+    Process running a generator. The generator yields events and is resumed when they are processed. The process itself is an event, triggered when the generator finishes.
+    """
+
+    __slots__ = ("_generator", "_target", "_resume")
+
+    def __init__(self, env, generator):
+        if not hasattr(generator, "throw"):
+            raise ValueError("%s is not a generator." % generator)
+        self.env = env
+        self.callbacks = []
+        self._value = _PENDING
+        self._ok = True
+        self._defused = False
+        self._generator = generator
+        self._resume = self.__resume #stored once, so that scheduling a wake-up does not create a new bound method
+        start = Event(env)
+        start._value = None
+        start.callbacks.append(self._resume)
+        self._target = start
+        env.schedule(start, URGENT) #processes start before other events at the same time, as in simpy
+
+    @property
+    def target(self):
+        """
+        The event that the process is waiting for.
+        """
+        return self._target
+
+    @property
+    def is_alive(self):
+        """
+        True until the generator finishes.
+        """
+        return self._value is _PENDING
+
+    def interrupt(self, cause=None):
+        """
+        Interrupt the process. The interrupt is thrown into the generator as an urgent event.
+        """
+        if self._value is not _PENDING:
+            raise RuntimeError("%s has terminated and cannot be interrupted." % self)
+        if self is self.env.active_process:
+            raise RuntimeError("A process is not allowed to interrupt itself.")
+        interruption = Event(self.env)
+        interruption._value = Interrupt(cause)
+        interruption._ok = False
+        interruption._defused = True
+        interruption.callbacks.append(self.__interrupt)
+        self.env.schedule(interruption, URGENT)
+
+    def __interrupt(self, event):
+        if self._value is not _PENDING:
+            return #the process finished before the interrupt arrived
+        self._target.callbacks.remove(self._resume)
+        self._resume(event)
+
+    def __resume(self, event):
+        env = self.env
+        env._active_proc = self
+        while True:
+            try:
+                if event._ok:
+                    event = self._generator.send(event._value)
+                else:
+                    event._defused = True
+                    exc = type(event._value)(*event._value.args)
+                    exc.__cause__ = event._value
+                    event = self._generator.throw(exc)
+            except StopIteration as e:
+                event = None
+                self._ok = True
+                self._value = e.args[0] if e.args else None
+                env.schedule(self)
+                break
+            except BaseException as e:
+                event = None
+                self._ok = False
+                self._value = e
+                env.schedule(self)
+                break
+            try:
+                if event.callbacks is not None:
+                    event.callbacks.append(self._resume)
+                    break
+            except AttributeError:
+                raise RuntimeError("Invalid yield value '%s'" % (event,)) from None
+        self._target = event
+        env._active_proc = None
+
+class AnyOf(Event):
+    """
+    Event triggered when any of events is processed.
+    """
+
+    __slots__ = ("_events",)
+
+    def __init__(self, env, events):
+        super().__init__(env)
+        self._events = tuple(events)
+        for event in self._events:
+            if event.callbacks is None:
+                self.__check(event)
+            else:
+                event.callbacks.append(self.__check)
+        self.callbacks.append(self.__build_value)
+
+    def __check(self, event):
+        if self._value is not _PENDING:
+            return
+        if not event._ok:
+            event._defused = True
+            self.fail(event._value)
+        else:
+            self.succeed()
+
+    def __build_value(self, event):
+        for each in self._events:
+            if each.callbacks and self.__check in each.callbacks:
+                each.callbacks.remove(self.__check)
+        if event._ok:
+            self._value = {each: each._value for each in self._events if each.callbacks is None}
+
+class Environment(object):
+    """
+    Heap-based environment, the native counterpart of simpy.Environment.
+    """
+
+    def __init__(self, initial_time=0):
+        self._now = initial_time
+        self._queue = []
+        self._eid = itertools.count().__next__
+        self._active_proc = None
+
+    @property
+    def now(self):
+        """
+        Current simulation time.
+        """
+        return self._now
+
+    @property
+    def active_process(self):
+        """
+        Process that is currently running.
+        """
+        return self._active_proc
+
+    def process(self, generator):
+        """
+        Start a new process for generator.
+        """
+        return Process(self, generator)
+
+    def timeout(self, delay=0, value=None):
+        """
+        Return an event processed after delay.
+        """
+        return Timeout(self, delay, value)
+
+    def event(self):
+        """
+        Return a new untriggered event.
+        """
+        return Event(self)
+
+    def any_of(self, events):
+        """
+        Return an event triggered when any of events is processed.
+        """
+        return AnyOf(self, events)
+
+    def schedule(self, event, priority=NORMAL, delay=0):
+        """
+        Schedule event with priority after delay.
+        """
+        heapq.heappush(self._queue, (self._now + delay, priority, self._eid(), event))
+
+    def schedule_triggered(self, event, priority=NORMAL, delay=0, value=None):
+        """
+        Trigger event with value and schedule it with priority after delay. Return the event.
+
+        Unlike succeed, which always uses normal priority, this lets events be processed before (URGENT) or after (a number above NORMAL) other events at the same time.
+        """
+        if event._value is not _PENDING:
+            raise RuntimeError("%s has already been triggered" % event)
+        event._ok = True
+        event._value = value
+        self.schedule(event, priority, delay)
+        return event
+
+    def peek(self):
+        """
+        Time of the next scheduled event, Infinity if there is none.
+        """
+        try:
+            return self._queue[0][0]
+        except IndexError:
+            return Infinity
+
+    def step(self):
+        """
+        Process the next event. Raise EmptySchedule if there is none.
+        """
+        try:
+            self._now, _, _, event = heapq.heappop(self._queue)
+        except IndexError:
+            raise EmptySchedule from None
+        callbacks, event.callbacks = event.callbacks, None
+        for callback in callbacks:
+            callback(event)
+        if not event._ok and not event._defused:
+            exc = type(event._value)(*event._value.args)
+            exc.__cause__ = event._value
+            raise exc
+
+    def run(self, until=None):
+        """
+        Run the simulation until the time (or the event) until is reached, or until no events are left.
+        """
+        stop = []
+        if until is not None:
+            if not isinstance(until, Event):
+                at = until if isinstance(until, int) else float(until)
+                if at <= self._now:
+                    raise ValueError("until (%s) must be greater than the current simulation time" % at)
+                until = Event(self)
+                until._value = None
+                self.schedule(until, URGENT, at - self._now) #stop before regular events at the same time
+            elif until.callbacks is None:
+                return until.value
+            until.callbacks.append(stop.append)
+        queue = self._queue
+        step = self.step
+        while not stop:
+            if not queue:
+                if until is not None:
+                    raise RuntimeError("No scheduled events left but 'until' event was not triggered: %s" % until)
+                return None
+            step()
+        return until._value
+
+class RealtimeEnvironment(Environment):
+    """
+    Environment synchronized with wall-clock time, the native counterpart of simpy.RealtimeEnvironment.
+    """
+
+    def __init__(self, initial_time=0, factor=1.0, strict=True):
+        super().__init__(initial_time)
+        self.env_start = initial_time
+        self.real_start = time.monotonic()
+        self.factor = factor
+        self.strict = strict
+
+    def sync(self):
+        """
+        Synchronize the start of the simulation with wall-clock time.
+        """
+        self.real_start = time.monotonic()
+
+    def step(self):
+        """
+        Wait until the next event is due in real time and process it.
+        """
+        evt_time = self.peek()
+        if evt_time is Infinity:
+            raise EmptySchedule
+        real_time = self.real_start + (evt_time - self.env_start) * self.factor
+        if self.strict and time.monotonic() - real_time > self.factor:
+            raise RuntimeError("Simulation too slow for real time (%.3fs)." % (time.monotonic() - real_time))
+        delta = real_time - time.monotonic()
+        if delta > 0:
+            time.sleep(delta)
+        super().step()
+
+class SimpyScheduling(object):
+    """
+    Adds schedule_triggered to simpy environments.
+    """
+
+    def schedule_triggered(self, event, priority=NORMAL, delay=0, value=None):
+        """
+        Trigger event with value and schedule it with priority after delay. Return the event.
+
+        simpy has no public way to trigger an event with a priority other than normal, so the event is triggered as simpy's own events (e.g., Timeout) do it.
+        """
+        if event.triggered:
+            raise RuntimeError("%s has already been triggered" % event)
+        event._ok = True
+        event._value = value
+        self.schedule(event, priority, delay)
+        return event
+
+class SimpyEnvironment(SimpyScheduling, simpy.Environment):
+    """
+    simpy.Environment with schedule_triggered.
+    """
+
+class SimpyRealtimeEnvironment(SimpyScheduling, simpy.RealtimeEnvironment):
+    """
+    simpy.RealtimeEnvironment with schedule_triggered.
+    """
@@ -2,6 +2,7 @@
 ACT-R simulations.
 """
 
+import collections
 import warnings
 
 try:
@@ -23,6 +24,7 @@ import simpy
 import pyactr.utilities as utilities
 import pyactr.vision as vision
 import pyactr.chunks as chunks
+import pyactr.scheduler as scheduler
 
 Event = utilities.Event
 
@@ -32,12 +34,21 @@ class Simulation(object):
     """
 
     _UNKNOWN = utilities._UNKNOWN
+
+    _PROCEDURAL_PRIORITY = 2 #priority of procedural conflict resolution; both schedulers use 0 for urgent and 1 for normal events, so procedural comes last at any time point
+
+    _SCHEDULERS = {"simpy": (scheduler.SimpyEnvironment, scheduler.SimpyRealtimeEnvironment), "native": (scheduler.Environment, scheduler.RealtimeEnvironment)} #environments used by schedulers, in simulated and in real time
     
-    def __init__(self, environment, realtime, trace, gui, buffers, used_productions, initial_time=0, environment_process=None, **kwargs):
+    def __init__(self, environment, realtime, trace, gui, buffers, used_productions, initial_time=0, environment_process=None, scheduler="simpy", **kwargs):
 
         self.gui = environment and gui and GUI
 
-        self.__simulation = simpy.Environment(initial_time=round(initial_time, 4))
+        try:
+            environments = self._SCHEDULERS[scheduler]
+        except KeyError:
+            raise utilities.ACTRError("Unknown scheduler '%s'; the scheduler has to be one of the following: %s" % (scheduler, ", ".join(sorted(self._SCHEDULERS))))
+
+        self.__simulation = environments[0](initial_time=round(initial_time, 4))
 
         self.__env = environment
         if self.__env:
@@ -46,7 +57,7 @@ class Simulation(object):
         self.__realtime = realtime
 
         if not self.gui and realtime:
-            self.__simulation = simpy.RealtimeEnvironment()
+            self.__simulation = environments[1]()
 
         self.__trace = trace
 
@@ -69,7 +80,7 @@ class Simulation(object):
         
         self.__proc_activate = self.__simulation.event() #special event (lock) for procedural module
         
-        self.__procs_started = [] #list of processes that are started as a result of production rules
+        self.__pending = {name: collections.deque() for name in self.__dict_extra_proc_activate} #buffers -> queues of processes started as a result of production rules (or environment) and not yet run by the buffers
 
         #activate environment process, if environment present
         if self.__env:
@@ -79,6 +90,8 @@ class Simulation(object):
 
         self.__last_event = None #used when stepping thru simulation
 
+        self.__watchers = [] #functions called with every event, used by run_until and collect
+
         #here below -- simulation values, accessible by user
         self.current_event = None
         self.now = self.__simulation.now
@@ -87,10 +100,16 @@ class Simulation(object):
         """
         Triggers proc_activate, needed to activate procedural process.
         """
-        if event.action != self.__pr._UNKNOWN and event.proc != self.__pr._PROCEDURAL:
+        if event.code != self.__pr._UNKNOWN and event.proc != self.__pr._PROCEDURAL:
             if not self.__proc_activate.triggered:
                 self.__proc_activate.succeed()
 
+    def __procedural_turn__(self):
+        """
+        Returns an event processed after all other events scheduled at the current time (including those that they trigger in turn).
+        """
+        return self.__simulation.schedule_triggered(self.__simulation.event(), self._PROCEDURAL_PRIORITY)
+
     def __envGenerator__(self, ep, **kwargs):
         """
         Creates simulation process for process in environment.
@@ -112,7 +131,7 @@ class Simulation(object):
             for name in self.__buffers:
                 if isinstance(self.__buffers[name], vision.VisualLocation) and self.__buffers[name].environment == self.__env:
                     proc = (name, self.__pr.automatic_search(name, self.__buffers[name], list(self.__env.stimulus.values()), self.__simulation.now))
-                    self.__procs_started.append(proc)
+                    self.__pending[name].append(proc[1])
                 elif isinstance(self.__buffers[name], vision.Visual) and self.__buffers[name].environment == self.__env and self.__buffers[name].attend_automatic:
                     try:
                         cf = tuple(self.__buffers[name].current_focus)
@@ -120,7 +139,7 @@ class Simulation(object):
                         pass
                     else:
                         proc = (name, self.__pr.automatic_buffering(name, self.__buffers[name], list(self.__env.stimulus.values()), self.__simulation.now))
-                        self.__procs_started.append(proc)
+                        self.__pending[name].append(proc[1])
                 else:
                     continue
                 if not self.__dict_extra_proc_activate[proc[0]].triggered:
@@ -148,16 +167,15 @@ class Simulation(object):
         """
         Creates simulation process for other rules.
         """
+        pending = self.__pending[name]
         while True:
-            try:
-                _, proc = next(filter(lambda x: x[0] == name, self.__procs_started))
-            except StopIteration:
+            if not pending:
                 if name in self.__interruptibles:
                     self.__interruptibles.pop(name) #remove this process from interruptibles since it's finished
                 yield self.__dict_extra_proc_activate[name]
                 self.__dict_extra_proc_activate[name] = self.__simulation.event()
             else:
-                self.__procs_started.remove((name, proc))
+                proc = pending.popleft()
                 if not self.__dict_extra_proc_activate[name].triggered:
                     self.__dict_extra_proc_activate[name].succeed() #activate modules that were used
                 pro = self.__simulation.process(self.__localprocess__(name, proc))
@@ -207,32 +225,37 @@ class Simulation(object):
         """
         Stores current event in self.current_event and prints event.
         """
-        if event.action != self.__pr._UNKNOWN:
+        if event.code != self.__pr._UNKNOWN:
             self.current_event = event
             if self.__trace and not self.gui:
                 print(event[0:3])
+            for watcher in self.__watchers:
+                watcher(event)
     
     def __printenv__(self, event):
         """
         Prints environment event.
         """
-        if event.action != self.__pr._UNKNOWN:
+        if event.code != self.__pr._UNKNOWN:
             self.current_event = event
+            for watcher in self.__watchers:
+                watcher(event)
 
     def __procprocessGenerator__(self):
         """
         Creates simulation process for procedural rules.
         """
         pro = self.__simulation.process(self.__localprocess__(self.__pr._PROCEDURAL, self.__pr.procedural_process(self.__simulation.now))) #create procedural process
-        self.__procs_started = yield pro #run the process, keep its return value
+        procs_started = yield pro #run the process, keep its return value (processes started by the rule)
         while True:
             try:
-                self.__procs_started.remove(self.__pr._PROCEDURAL)
+                procs_started.remove(self.__pr._PROCEDURAL)
             except ValueError:
                 yield self.__proc_activate #wait for proc_activate
             else:
-                for proc in self.__procs_started:
+                for proc in procs_started:
                     name = proc[0]
+                    self.__pending[name].append(proc[1])
                     if not self.__dict_extra_proc_activate[name].triggered:
                         if proc[1].__name__ in self.__pr._INTERRUPTIBLE:
                             self.__interruptibles[name] = proc[1] #add new process interruptibles if the process can be interrupted according to ACT-R
@@ -241,10 +264,9 @@ class Simulation(object):
                         if name in self.__interruptibles and proc[1] != self.__interruptibles[name]:
                             self.__interruptibles[name] = proc[1]
                             self.__dict_extra_proc[name].interrupt() #otherwise, interrupt them
-            for _ in range(5):
-                yield self.__simulation.timeout(0) #move procedural process to the bottom; right now, this is a hack - it yields 0 timeout five times, so other processes get enough cycles to start etc.
+            yield self.__procedural_turn__() #move procedural process to the bottom, after all module events at the current time
             pro = self.__simulation.process(self.__localprocess__(self.__pr._PROCEDURAL, self.__pr.procedural_process(self.__simulation.now)))
-            self.__procs_started = yield pro
+            procs_started = yield pro
             self.__proc_activate = self.__simulation.event() #start the event
 
     def run(self, max_time=1):
@@ -275,13 +297,78 @@ class Simulation(object):
         """
         while True:
             self.__simulation.step()
-            if self.current_event and self.current_event.action != self._UNKNOWN and self.current_event != self.__last_event:
+            if self.current_event and self.current_event.code != self._UNKNOWN and self.current_event != self.__last_event:
                 self.__last_event = self.current_event
                 break
             if self.__simulation.peek() == float("inf"):
                 self.__pr.compile_rules() #at the end of the simulation, run compilation (the last two rules are not yet compiled)
 
 
+    @staticmethod
+    def __matcher__(pattern):
+        """
+        Returns a function testing events against pattern. Pattern is either a function taking an event, an action code (see utilities.Action) or a string; a string matches events whose action starts with it.
+        """
+        if isinstance(pattern, utilities.Action):
+            return lambda event: event.code is pattern
+        elif callable(pattern):
+            return pattern
+        elif isinstance(pattern, str):
+            return lambda event: event.startswith(pattern)
+        else:
+            raise utilities.ACTRError("The pattern '%s' is neither a string nor a function taking events" % (pattern,))
+
+    def __run_watched__(self, watcher, found, max_time):
+        """
+        Runs simulation, calling watcher with every event, until found is non-empty, max_time is reached or no event is left.
+        """
+        step = self.__simulation.step
+        peek = self.__simulation.peek
+        if max_time is None:
+            max_time = float("inf")
+        self.__watchers.append(watcher)
+        try:
+            while not found and peek() < max_time:
+                step()
+        except simpy.core.EmptySchedule:
+            pass
+        finally:
+            self.__watchers.remove(watcher)
+            self.__last_event = self.current_event #the last event was reported, step continues with the next one
+        if peek() == float("inf"):
+            self.__pr.compile_rules() #at the end of the simulation, run compilation (the last two rules are not yet compiled)
+
+    def run_until(self, until, max_time=None):
+        """
+        Run simulation until an event matching until happens. until is either a function taking an event (and returning True if the simulation should stop), an action code (e.g., utilities.KEY_PRESSED) or a string; a string matches events whose action starts with it (e.g., "KEY PRESSED: SPACE").
+
+        The simulation stops right after the matching event, as if it was stepped through, and the time of the event is returned. A following call of step moves to the next event. If no event matches before max_time (or before the simulation ends), None is returned.
+        """
+        matches = self.__matcher__(until)
+        found = []
+        def watcher(event):
+            if not found and matches(event):
+                found.append(event.time)
+                self.__last_event = event
+        self.__run_watched__(watcher, found, max_time)
+        if found:
+            return found[0]
+
+    def collect(self, patterns, max_time=None):
+        """
+        Run simulation until max_time (or until the simulation ends) and collect times of events matching patterns. Patterns are functions, action codes or strings, as in run_until.
+
+        Returns a dictionary from patterns to lists of times of matching events.
+        """
+        collected = {pattern: [] for pattern in patterns}
+        matchers = [(self.__matcher__(pattern), collected[pattern]) for pattern in collected]
+        def watcher(event):
+            for matches, times in matchers:
+                if matches(event):
+                    times.append(event.time)
+        self.__run_watched__(watcher, (), max_time)
+        return collected
+
     def steps(self, count):
         """
         Make several one or more steps through simulation. The number of steps is given in count.
@@ -8,6 +8,7 @@ import collections
 import re
 import warnings
 import math
+import pickle
 
 import simpy
 import numpy as np
@@ -17,6 +18,7 @@ import pyactr.chunks as chunks
 import pyactr.buffers as buffers
 import pyactr.goals as goals
 import pyactr.declarative as declarative
+import pyactr.productions as productions
 import pyactr.utilities as util
 
 import pyactr as actr
@@ -385,6 +387,121 @@ class Testchunkstring2(unittest.TestCase):
         self.assertTrue(self.chunk17 <= self.chunk18)
         self.assertFalse(self.chunk19 <= self.chunk7)
 
+class TestChunkInterning(unittest.TestCase):
+    """
+    Testing that chunks without variables are shared and chunks with variables are separate patterns.
+    """
+
+    def setUp(self):
+        chunks.chunktype("interned", "arg1, arg2")
+        self.chunk = chunks.makechunk("", "interned", arg1="a", arg2=chunks.makechunk("", "interned", arg1="b"))
+        self.chunk2 = chunks.chunkstring(string="isa interned arg1 a arg2 'b'")
+
+    def test_interning(self):
+        self.assertIs(self.chunk, chunks.makechunk("", "interned", arg1="a", arg2=chunks.makechunk("", "interned", arg1="b")))
+        self.assertIsNot(self.chunk, self.chunk2)
+        self.assertIs(self.chunk2, chunks.Chunk("interned", arg2="b", arg1="a"))
+        self.assertIsNot(chunks.Chunk("interned", arg1="a"), chunks.Chunk("undefined_interned", arg1="a", arg2=None))
+        self.assertEqual(chunks.Chunk("interned", arg1="a"), chunks.Chunk("undefined_interned", arg1="a"))
+        self.assertFalse(hasattr(self.chunk, "__dict__"))
+        self.assertEqual(type(self.chunk), chunks.Chunk)
+        self.assertIs(pickle.loads(pickle.dumps(self.chunk)), self.chunk)
+
+    def test_nested_types(self):
+        first = chunks.Chunk("interned", arg1=chunks.Chunk("nested_first", arg1="a"))
+        second = chunks.Chunk("interned", arg1=chunks.Chunk("nested_second", arg1="a"))
+        self.assertEqual(chunks.Chunk("nested_first", arg1="a"), chunks.Chunk("nested_second", arg1="a")) #nested chunks compare equal
+        self.assertIsNot(first, second)
+        self.assertEqual(second.arg1.values.typename, "nested_second")
+        self.assertEqual(str(second), "interned(arg1= nested_second(arg1= a), arg2= )")
+        self.assertIs(second, chunks.Chunk("interned", arg1=chunks.Chunk("nested_second", arg1="a")))
+
+    def test_deep_nesting(self):
+        chunks.chunktype("node", "val, next")
+        dm = declarative.DecMem()
+        chain = chunks.Chunk("node", val=0)
+        for i in range(1, 1000):
+            chain = chunks.Chunk("node", val=i, next=chain)
+            dm.add(chain, i)
+        self.assertEqual(len(dm), 999)
+        self.assertIs(chain.next.values, chunks.Chunk("node", val=998, next=chain.next.values.next.values)) #nested chunks are interned by identity
+        self.assertIsNot(chain.next.values, chunks.Chunk("node", val=998, next=chunks.Chunk("node", val=996)))
+
+    def test_patterns(self):
+        pattern = chunks.chunkstring(string="isa interned arg1 =x arg2 ~b")
+        pattern2 = chunks.chunkstring(string="isa interned arg1 =x arg2 ~b")
+        self.assertIsInstance(pattern, chunks.PatternChunk)
+        self.assertIsNot(pattern, pattern2)
+        self.assertEqual(pattern, pattern2)
+        self.assertTrue(pattern <= self.chunk)
+        self.assertEqual(pattern.boundvars, {"=x": "a"})
+        self.assertEqual(pattern2.boundvars, {})
+        self.assertNotEqual(pattern, pattern2)
+
+class TestPattern(unittest.TestCase):
+    """
+    Testing compiled patterns against matching of chunks.
+    """
+
+    def setUp(self):
+        chunks.chunktype("patterned", "arg1, arg2, arg3")
+        self.chunks = [chunks.chunkstring(string=string) for string in ["isa patterned arg1 a arg2 b", "isa patterned arg1 a arg2 a arg3 c", "isa patterned arg1 b", "isa other arg1 a arg2 b"]]
+        self.patterns = [chunks.chunkstring(string=string) for string in ["isa patterned arg1 =x arg2 =x", "isa patterned arg1 =x arg2 ~=x", "isa patterned arg1 a arg3 ~c", "isa patterned arg1 ~=y arg2 =y", "isa patterned arg3 None", "isa patterned arg1 a arg2 b"]]
+
+    def test_match(self):
+        for bindings in [{}, {"=x": "a"}, {"=x": "b", "=y": "b"}, {"~=x": {"a"}}]:
+            for pattern in self.patterns:
+                for chunk in self.chunks:
+                    pattern.boundvars = dict(bindings)
+                    expected = dict(pattern.boundvars) if pattern <= chunk else None
+                    matched = chunks.Pattern.compile(pattern).match(chunk, bindings)
+                    self.assertEqual(matched, expected)
+        self.assertEqual(chunks.Pattern.compile(self.patterns[0]).match(self.chunks[1], {}), {"=x": "a"})
+        self.assertIs(chunks.Pattern.compile(self.patterns[0]), chunks.Pattern.compile(chunks.chunkstring(string="isa patterned arg1 =x arg2 =x")))
+
+class TestTemplate(unittest.TestCase):
+    """
+    Testing compiled templates and chunks built from them.
+    """
+
+    def setUp(self):
+        chunks.chunktype("templated", "arg1, arg2, arg3")
+        self.templates = [chunks.chunkstring(string=string) for string in ["isa templated arg1 =x arg2 b", "isa templated arg1 a arg3 None", "isa templated arg2 =y", "isa templated arg1 ~a"]] + [chunks.Chunk("templated", arg1=util.VISIONGREATER)]
+        self.bindings = {"=x": "c", "=y": chunks.chunkstring(string="isa templated arg1 d")}
+
+    def test_fill(self):
+        for template in self.templates:
+            try:
+                expected = {x[0]: util.check_bound_vars(self.bindings, x[1]) for x in template.removeunused()}
+            except (util.ACTRError, TypeError) as e:
+                self.assertRaises(type(e), chunks.Template.compile(template).fill, self.bindings)
+            else:
+                self.assertEqual(chunks.Template.compile(template).fill(self.bindings), expected)
+        self.assertRaises(util.ACTRError, chunks.Template.compile(self.templates[0]).fill, {})
+
+    def test_build(self):
+        chunk = chunks.chunkstring(string="isa templated arg1 a")
+        for template in self.templates[:3]:
+            values = dict(chunk)
+            values.update(chunks.Template.compile(template).fill(self.bindings))
+            self.assertIs(chunks.Chunk.build("templated", values), chunks.Chunk("templated", **values))
+        self.assertEqual(chunks.Chunk.build("templated", {"arg1": "e"}), chunks.Chunk("templated", arg1="e"))
+
+class TestParsingCache(unittest.TestCase):
+    """
+    Testing that cached parses of chunk strings agree with chunks in the database of chunks.
+    """
+
+    def test_chunkstring(self):
+        self.assertIs(util.getchunk(), util.getchunk())
+        self.assertIs(util.getrule(), util.getrule())
+        string = "isa cached_owner owner cached_dog"
+        self.assertEqual(chunks.chunkstring(string=string).owner.values, "cached_dog")
+        dog = chunks.makechunk("cached_dog", "cached_animal", kind="dog")
+        self.assertIs(chunks.chunkstring(string=string).owner.values, dog)
+        self.assertIs(chunks.chunkstring(string=string), chunks.chunkstring(string=string))
+        dog2 = chunks.makechunk("cached_dog", "cached_animal", kind="poodle")
+        self.assertIs(chunks.chunkstring(string=string).owner.values, dog2)
 
 class TestBuffers(unittest.TestCase):
     """
@@ -415,6 +532,204 @@ class TestBuffers(unittest.TestCase):
         self.g2.add(chunks.makechunk("", "finalchunk", x=30))
         self.assertEqual(self.dm.keys(), {chunks.makechunk("", "origo", x=1), chunks.makechunk("", "bufferchunk", y=10), chunks.makechunk("", "goalchunk", z=10), chunks.makechunk("", "finalchunk", x=-5)})
 
+class TestRetrievalCandidates(unittest.TestCase):
+    """
+    Testing the index of declarative memory used to find candidates for retrieval.
+    """
+
+    def setUp(self):
+        chunks.chunktype("word", "form, cat, pos")
+        chunks.chunktype("phrase", "cat, head")
+        self.dm = declarative.DecMem()
+        self.noun = chunks.makechunk("", "word", form="dog", cat="N")
+        self.verb = chunks.makechunk("", "word", form="barks", cat="V")
+        self.noun2 = chunks.makechunk("", "word", form="cat", cat="N", pos="subj")
+        self.np = chunks.makechunk("", "phrase", cat="N", head=self.noun)
+        for each in [self.noun, self.verb, self.noun2, self.np]:
+            self.dm.add(each, 0)
+        self.retrieval = declarative.DecMemBuffer(self.dm)
+
+    def test_candidates(self):
+        self.assertEqual(self.dm.candidates(chunks.chunkstring(string="isa word cat N")), [self.noun, self.noun2, self.np])
+        self.assertEqual(self.dm.candidates(chunks.chunkstring(string="isa word cat N pos subj")), [self.noun2])
+        self.assertEqual(self.dm.candidates(chunks.makechunk("", "phrase", head=self.noun)), [self.np])
+        self.assertEqual(self.dm.candidates(chunks.chunkstring(string="isa word cat Adj")), [])
+        self.assertEqual(list(self.dm.candidates(chunks.chunkstring(string="isa word cat ~N pos None"))), [self.noun, self.verb, self.noun2, self.np])
+        del self.dm[self.noun2]
+        self.assertEqual(self.dm.candidates(chunks.chunkstring(string="isa word cat N")), [self.noun, self.np])
+        self.assertEqual(self.dm.copy().candidates(chunks.chunkstring(string="isa word cat N")), [self.noun, self.np])
+
+    def test_retrieve(self):
+        parameters = actr.ACTRModel().model_parameters
+        for string in ["isa word cat N", "isa word cat ~N", "isa word form =x", "isa word pos None", "isa phrase cat N"]:
+            pattern = chunks.chunkstring(string=string)
+            retrieved, _ = self.retrieval.retrieve(1, pattern, {"=x": "dog"}, {}, {}, parameters)
+            scanned = None
+            for chunk in self.dm:
+                if chunks.Chunk(pattern.typename, **{x[0]: util.check_bound_vars({"=x": "dog"}, x[1], False) for x in pattern.removeunused()}) <= chunk:
+                    scanned = chunk
+            self.assertEqual(retrieved, scanned)
+
+class TestTimeStore(unittest.TestCase):
+    """
+    Testing storage of presentation times in declarative memory.
+    """
+
+    def setUp(self):
+        chunks.chunktype("rehearsed", "value")
+        self.dm = declarative.DecMem()
+        self.chunks = [chunks.makechunk("", "rehearsed", value=str(i)) for i in range(5)]
+
+    def test_times(self):
+        for time in range(100):
+            self.dm.add(self.chunks[time % 5], time)
+        earlier = self.dm[self.chunks[0]]
+        self.dm.add(self.chunks[0], [100, 101])
+        self.dm[self.chunks[1]] = 0.5
+        del self.dm[self.chunks[2]]
+        np.testing.assert_array_equal(earlier, np.arange(0, 100, 5))
+        np.testing.assert_array_equal(self.dm[self.chunks[0]], np.append(np.arange(0, 100, 5), [100, 101]))
+        np.testing.assert_array_equal(self.dm[self.chunks[1]], np.array([0.5]))
+        self.assertEqual(len(self.dm), 4)
+        times, offsets = self.dm.times([self.chunks[3], self.chunks[1]])
+        np.testing.assert_array_equal(times, np.append(np.arange(3, 100, 5), 0.5))
+        np.testing.assert_array_equal(offsets, [0, 20])
+        dm = self.dm.copy()
+        dm.add(self.chunks[4], 200)
+        self.assertEqual(len(self.dm[self.chunks[4]]), 20)
+        self.assertEqual(len(dm[self.chunks[4]]), 21)
+
+    def test_history(self):
+        for time in range(100):
+            self.dm.add(self.chunks[time % 5], time)
+        self.dm.history = 3
+        np.testing.assert_array_equal(self.dm[self.chunks[0]], [85, 90, 95])
+        for time in range(100, 130):
+            self.dm.add(self.chunks[time % 5], time)
+        self.assertTrue(3 <= len(self.dm[self.chunks[0]]) <= 6)
+        counts, firsts = self.dm.dropped(self.chunks[:2])
+        np.testing.assert_array_equal(counts + [len(self.dm[x]) for x in self.chunks[:2]], [26, 26])
+        np.testing.assert_array_equal(firsts, [0, 1])
+        self.dm[self.chunks[0]] = 0.5
+        self.assertEqual(self.dm.dropped([self.chunks[0]])[0][0], 0)
+        self.assertRaises(util.ACTRError, setattr, self.dm, "history", 0)
+
+class TestBatchActivation(unittest.TestCase):
+    """
+    Testing that activations of all candidates computed at once agree with activations computed chunk by chunk.
+    """
+
+    def setUp(self):
+        chunks.chunktype("item", "form, cat")
+        self.dm = declarative.DecMem()
+        np.random.seed(1)
+        self.items = [chunks.makechunk("", "item", form="form"+str(i), cat=["N", "V"][i%2]) for i in range(40)]
+        for each in self.items:
+            self.dm.add(each, np.sort(np.round(np.random.uniform(0, 20, np.random.randint(1, 12)), 4)))
+        self.dm.add(self.items[0], 25) #presented at the time of retrieval
+        self.dm.activations[self.items[3]] = 1.5
+        self.retrieval = declarative.DecMemBuffer(self.dm)
+        self.parameters = actr.ACTRModel(subsymbolic=True, instantaneous_noise=0.4, retrieval_threshold=-1).model_parameters
+
+    def test_baselevel(self):
+        times = [self.dm[x] for x in self.items]
+        offsets = np.cumsum([0] + [len(x) for x in times[:-1]])
+        for optimized in [False, True]:
+            B, defined = util.baselevel_learning_batch(30, np.concatenate(times), offsets, True, 0.5, [self.dm.activations.get(x) for x in self.items], optimized)
+            self.assertTrue(defined.all())
+            for idx, chunk in enumerate(self.items):
+                self.assertAlmostEqual(B[idx], util.baselevel_learning(30, self.dm[chunk], True, 0.5, self.dm.activations.get(chunk), optimized))
+        B, defined = util.baselevel_learning_batch(30, np.array([]), [0, 0], False, 0.5, [None, 2])
+        self.assertEqual(list(defined), [False, True])
+        self.assertEqual(B[1], 2)
+
+    def test_retrieve(self):
+        for string in ["isa item cat N", "isa item cat V"]:
+            pattern = chunks.chunkstring(string=string)
+            np.random.seed(10)
+            retrieved, latency = self.retrieval.retrieve(25, pattern, {}, {}, {}, self.parameters)
+            np.random.seed(10)
+            max_A = float("-inf")
+            for chunk in self.dm:
+                if pattern <= chunk:
+                    A = util.baselevel_learning(25, self.dm[chunk], True, 0.5, self.dm.activations.get(chunk)) + util.calculate_instantaneous_noise(0.4)
+                    if A >= -1 and max_A < A:
+                        max_A, expected = A, chunk
+            self.assertEqual(retrieved, expected)
+            self.assertAlmostEqual(self.retrieval.activation, max_A)
+            self.assertAlmostEqual(latency, util.retrieval_latency(max_A, 0.1, 1))
+
+    def test_hybrid(self):
+        times = [self.dm[x] for x in self.items]
+        offsets = np.cumsum([0] + [len(x) for x in times[:-1]])
+        exact, _ = util.baselevel_learning_batch(30, np.concatenate(times), offsets, True, 0.5)
+        B, _ = util.baselevel_learning_batch(30, np.concatenate(times), offsets, True, 0.5, optimized_learning=12)
+        np.testing.assert_allclose(B, exact) #all presentations are recent
+        dropped = np.random.randint(0, 5, 40), np.random.uniform(-10, 0, 40)
+        for k in [2, 4]:
+            B, defined = util.baselevel_learning_batch(30, np.concatenate(times), offsets, True, 0.5, [self.dm.activations.get(x) for x in self.items], k, dropped)
+            self.assertTrue(defined.all())
+            for idx, chunk in enumerate(self.items):
+                self.assertAlmostEqual(B[idx], util.baselevel_learning(30, self.dm[chunk], True, 0.5, self.dm.activations.get(chunk), k, (dropped[0][idx], dropped[1][idx])))
+        for idx, chunk in enumerate(self.items):
+            self.assertEqual(util.baselevel_learning(30, self.dm[chunk], True, 0.5, optimized_learning=1), util.baselevel_learning(30, self.dm[chunk], True, 0.5, optimized_learning=True)) #1 stands for True
+        B, _ = util.baselevel_learning_batch(30, np.concatenate(times), offsets, True, 0.5, optimized_learning=1)
+        np.testing.assert_allclose(B, util.baselevel_learning_batch(30, np.concatenate(times), offsets, True, 0.5, optimized_learning=True)[0])
+        times = np.sort(np.random.uniform(0, 1000, 5000))
+        self.assertLess(abs(util.baselevel_learning(1010, times, True, 0.5, optimized_learning=10) - util.baselevel_learning(1010, times, True, 0.5)), 0.1)
+        evenly = np.arange(1, 101)
+        self.assertAlmostEqual(util.baselevel_learning(101, evenly, True, 0.5, optimized_learning=10), util.baselevel_learning(101, evenly, True, 0.5), 1)
+        model = actr.ACTRModel(optimized_learning=4)
+        model.decmem.add(self.items[0], range(20))
+        model.simulation(trace=False)
+        self.assertEqual(model.decmem.history, None) #simulations do not truncate presentations
+        self.assertEqual(len(model.decmem[self.items[0]]), 20)
+        B, _ = util.baselevel_learning_batch(30, np.arange(20.0), [0], True, 0.5, optimized_learning=4)
+        model.decmem.history = 4 #truncation is opt-in and gives the same hybrid activation
+        self.assertEqual(len(model.decmem[self.items[0]]), 4)
+        times = model.decmem.times([self.items[0]])
+        self.assertAlmostEqual(util.baselevel_learning_batch(30, times[0], times[1], True, 0.5, optimized_learning=4, dropped=model.decmem.dropped([self.items[0]]))[0][0], B[0])
+
+    def test_partial_matching(self):
+        similarities = declarative.SimilarityMatrix({("N", "V"): -0.5, ("V", "N"): -0.7, ("form1", "form3"): -0.2, ("V", "V"): -0.1})
+        self.assertEqual(similarities[("N", "V")], -0.5)
+        self.assertEqual(similarities.get(("N", "N"), -1), -1)
+        self.assertEqual(len(similarities), 4)
+        del self.dm[self.items[5]]
+        self.dm.add(chunks.makechunk("", "item", form="form3"))
+        old_similarities = chunks.Chunk._similarities
+        chunks.Chunk._similarities = similarities
+        try:
+            for string in ["isa item cat N", "isa item cat V form form1", "isa item form form3 cat ~V", "isa item form form8"]:
+                pattern = chunks.chunkstring(string=string)
+                A_pm = self.dm.partial_matching(list(self.dm), pattern, similarities, 2)
+                for idx, chunk in enumerate(self.dm):
+                    self.assertEqual(A_pm[idx], pattern.match(chunk, partialmatching=True, mismatch_penalty=2))
+            similarities[("N", "V")] = -0.3
+            pattern = chunks.chunkstring(string="isa item cat V")
+            A_pm = self.dm.partial_matching(list(self.dm), pattern, similarities)
+            for idx, chunk in enumerate(self.dm):
+                self.assertEqual(A_pm[idx], pattern.match(chunk, partialmatching=True))
+        finally:
+            chunks.Chunk._similarities = old_similarities
+
+    def test_partial_matching_types(self):
+        chunks.chunktype("first", "x")
+        chunks.chunktype("second", "y")
+        dm = declarative.DecMem()
+        dm.add(chunks.makechunk("", "first", x="v1"))
+        for i in range(40):
+            dm.add(chunks.makechunk("", "second", y="w"+str(i))) #rows past the first column of slot x
+        similarities = declarative.SimilarityMatrix()
+        pattern = chunks.chunkstring(string="isa first x v1")
+        A_pm = dm.partial_matching(list(dm), pattern, similarities)
+        for idx, chunk in enumerate(dm):
+            self.assertEqual(A_pm[idx], pattern.match(chunk, partialmatching=True))
+        retrieval = declarative.DecMemBuffer(dm)
+        parameters = actr.ACTRModel(subsymbolic=True, partial_matching=True, retrieval_threshold=-5).model_parameters
+        retrieved, _ = retrieval.retrieve(1, pattern, {}, {}, {}, parameters)
+        self.assertEqual(retrieved, chunks.makechunk("", "first", x="v1"))
+
 class TestCountModel(unittest.TestCase):
     """
     Testing Count model, the simplest model in Lisp ACT-R.
@@ -502,6 +817,281 @@ class TestCountModel(unittest.TestCase):
         self.assertEqual(self.sim.show_time(), 0.3)
 
 
+class TestFailingRules(unittest.TestCase):
+    """
+    Testing that rules excluded by their constant tests never match.
+    """
+
+    def setUp(self):
+        counting = modeltests.Counting()
+        self.test = counting.model
+        self.test.productions(counting.start, counting.increment, counting.stop)
+        self.sim = self.test.simulation(trace=False)
+
+    def test_procedure(self):
+        warnings.simplefilter("ignore")
+        rules = self.test._ACTRModel__productions
+        excluded = set()
+        while True:
+            self.sim.step()
+            if self.sim.current_event.action == "CONFLICT RESOLUTION":
+                failing = self.sim._Simulation__pr.failing_rules()
+                excluded.update(failing)
+                for rulename in rules:
+                    if self.sim._Simulation__pr.LHStest(next(rules[rulename]["rule"]()), {}):
+                        self.assertNotIn(rulename, failing)
+            if self.sim.current_event.action == "NO RULE FOUND":
+                break
+        self.assertIn("increment", excluded) #retrieval is empty at first
+
+    def test_changed_rules(self):
+        pr = self.sim._Simulation__pr
+        rules = self.test._ACTRModel__productions
+        self.assertEqual(pr.failing_rules(), {"increment"}) #retrieval is empty
+        renewed = []
+        constant_tests = pr.constant_tests
+        def counted(rulename):
+            renewed.append(rulename)
+            return constant_tests(rulename)
+        pr.constant_tests = counted
+        pr.failing_rules()
+        self.assertEqual(renewed, []) #nothing changed, no rule is checked
+        def start():
+            yield {"=g": actr.chunks.makechunk("", "countFrom", start="=x"), "=retrieval": actr.chunks.makechunk("", "countOrder", first=1)}
+            yield {}
+        rules["start"]["rule"] = start
+        self.assertEqual(pr.failing_rules(), {"increment", "start"})
+        self.assertEqual(renewed, ["start"])
+        self.assertEqual(pr.ordered_rulenames.changed, set()) #rules are not scanned for changes, the queue reports them
+        rules["start"] = {"rule": rules["stop"]["rule"], "utility": 0, "reward": None} #replacing the whole production
+        self.assertEqual(pr.failing_rules(), {"increment"})
+        self.assertEqual(renewed, ["start", "start"])
+        self.assertEqual(list(pr.ordered_rulenames), ["start", "increment", "stop"])
+
+    def check_candidates(self, sim, max_time=2):
+        pr = sim._Simulation__pr
+        evaluated = []
+        buffer_failing = pr._ProductionRules__buffer_failing
+        def counted(name, chunk):
+            evaluated.append(name)
+            return buffer_failing(name, chunk)
+        pr._ProductionRules__buffer_failing = counted
+        resolutions = 0
+        while sim.show_time() < max_time:
+            sim.step()
+            if sim.current_event.action == "CONFLICT RESOLUTION":
+                resolutions += 1
+                failing = pr.failing_rules()
+                candidates = pr.candidate_rules()
+                self.assertEqual(list(candidates), [rulename for rulename in pr.ordered_rulenames if rulename in candidates])
+                self.assertLessEqual(set(pr.ordered_rulenames) - set(candidates), failing)
+                self.assertEqual(pr.failing_rules(), failing)
+                self.assertIs(pr.candidate_rules(), candidates) #the same goal content is looked up
+                for rulename in pr.ordered_rulenames:
+                    if pr.LHStest(pr.rules.compiled(rulename), {}):
+                        self.assertIn(rulename, candidates)
+            if sim.current_event.action == "NO RULE FOUND":
+                break
+        return evaluated, resolutions
+
+    def test_candidates(self):
+        warnings.simplefilter("ignore")
+        self.check_candidates(self.sim)
+
+    def test_goal_states(self):
+        model = actr.ACTRModel()
+        model.chunktype("task", "state")
+        model.goal.add(actr.makechunk("", "task", state="one"))
+        model.productionstring(name="one", string="""
+        =g>
+        isa task
+        state one
+        ==>
+        =g>
+        isa task
+        state two""")
+        model.productionstring(name="two", string="""
+        =g>
+        isa task
+        state two
+        ==>
+        =g>
+        isa task
+        state one""")
+        model.productionstring(name="three", string="""
+        =g>
+        isa task
+        state three
+        ==>
+        ~g>""")
+        evaluated, resolutions = self.check_candidates(model.simulation(trace=False))
+        self.assertGreater(resolutions, 10)
+        self.assertEqual(evaluated, ["g", "g"]) #once per goal state; recurring states are looked up
+
+class TestCompiledRules(unittest.TestCase):
+    """
+    Testing that rules are compiled once and that compiled rules agree with rule functions.
+    """
+
+    def setUp(self):
+        counting = modeltests.Counting_stringversion()
+        self.rules = counting.model._ACTRModel__productions
+
+    def test_compiled(self):
+        for rulename in self.rules:
+            compiled = self.rules.compiled(rulename)
+            self.assertIs(self.rules.compiled(rulename), compiled)
+            production = self.rules[rulename]["rule"]()
+            self.assertEqual(dict(compiled.lhs), next(production))
+            rhs = next(production)
+            self.assertEqual(dict(compiled.rhs), rhs)
+            self.assertEqual(compiled.updated, {key[1:] for key in rhs})
+            self.assertEqual([code for code, _, _ in compiled.actions], sorted((key[0] for key in rhs), key=lambda x: self.rules._ORDERING[x]))
+
+    def test_changed_rule(self):
+        compiled = self.rules.compiled("increment")
+        self.rules["increment"]["rule"] = self.rules["stop"]["rule"]
+        self.assertIsNot(self.rules.compiled("increment"), compiled)
+        self.assertEqual(self.rules.compiled("increment").lhs, self.rules.compiled("stop").lhs)
+
+    def test_invalid_rhs(self):
+        def invalid():
+            yield {}
+            yield {"%g": None}
+        self.rules.update({"invalid": {"rule": invalid, "utility": 0, "reward": None}})
+        self.assertIsInstance(self.rules.compiled("invalid").actions, util.ACTRError)
+
+class TestNoisySelection(unittest.TestCase):
+    """
+    Testing that rule selection with utility noise selects the same rules as testing rules one by one.
+    """
+
+    def setUp(self):
+        counting = modeltests.Counting()
+        self.test = counting.model
+        self.test.model_parameters.update({"subsymbolic": True, "utility_noise": 1})
+        self.test.productions(counting.start, counting.increment, counting.stop)
+        self.sim = self.test.simulation(trace=False)
+
+    def test_procedure(self):
+        warnings.simplefilter("ignore")
+        pr = self.sim._Simulation__pr
+        for _ in range(50):
+            self.sim.step()
+            if self.sim.current_event.action == "CONFLICT RESOLUTION":
+                state = np.random.get_state()
+                max_utility, selected = float("-inf"), None
+                for rulename in pr.ordered_rulenames:
+                    utility = pr.rules[rulename]["utility"] + util.calculate_instantaneous_noise(1)
+                    if max_utility <= utility and pr.LHStest(pr.rules.compiled(rulename), {}):
+                        max_utility, selected = utility, rulename
+                after = np.random.get_state()[1]
+                np.random.set_state(state)
+                self.assertEqual(pr.noisy_selection(pr.failing_rules()), selected)
+                self.assertTrue(np.array_equal(np.random.get_state()[1], after))
+                np.random.set_state(state)
+            if self.sim.current_event.action == "NO RULE FOUND":
+                break
+
+class TestRuleQueue(unittest.TestCase):
+    """
+    Testing that rules stay ordered by utilities.
+    """
+
+    def setUp(self):
+        counting = modeltests.Counting()
+        self.test = counting.model
+        self.rules = self.test.productions(counting.start, counting.increment, counting.stop)
+        self.queue = productions.RuleQueue(self.rules, self.rules.keys())
+
+    def test_order(self):
+        self.assertEqual(list(self.queue), ["start", "increment", "stop"])
+        self.rules["stop"]["utility"] = 2
+        self.rules["increment"]["utility"] = 1
+        self.assertEqual(list(self.queue), ["stop", "increment", "start"])
+        self.rules["stop"]["utility"] = 0
+        self.assertEqual(list(self.queue), ["increment", "start", "stop"])
+
+    def test_added(self):
+        self.rules.update({"new": {"rule": self.rules["stop"]["rule"], "utility": 1, "reward": None}})
+        self.queue.append("new")
+        self.assertEqual(list(self.queue), ["new", "start", "increment", "stop"])
+        self.rules["new"]["utility"] = -1
+        self.assertEqual(list(self.queue), ["start", "increment", "stop", "new"])
+
+    def test_simulation(self):
+        sim = self.test.simulation(trace=False)
+        self.rules["stop"]["utility"] = 1
+        self.assertEqual(list(sim._Simulation__pr.ordered_rulenames), ["stop", "start", "increment"])
+
+class TestConditionStatistics(unittest.TestCase):
+    """
+    Testing that LHS conditions are ordered and profiled without changing the simulation.
+    """
+
+    def run_model(self, **model_parameters):
+        counting = modeltests.Counting_stringversion()
+        counting.model.model_parameters.update(model_parameters)
+        sim = counting.model.simulation(trace=False)
+        events = []
+        while True:
+            sim.step()
+            events.append(sim.current_event)
+            if sim.current_event.action == "NO RULE FOUND" and sim.current_event.time > 0.25:
+                break
+        return counting.model, events
+
+    def test_selection(self):
+        rules = self.run_model()[0].used_productions.rules
+        for rulename in rules:
+            compiled = rules.compiled(rulename)
+            self.assertEqual(set(compiled.selection), set(compiled.tests))
+            codes = [code for code, _, _ in compiled.selection]
+            self.assertEqual(codes, sorted(codes, key=lambda x: x != "?"))
+        self.assertEqual(rules.compiled("increment").movable, 0)
+
+    def test_statistics(self):
+        model, events = self.run_model(lhs_profiling=True)
+        self.assertEqual(events, self.run_model()[1])
+        statistics = model.condition_statistics()
+        self.assertEqual(set(statistics["increment"]), {"=g", "=retrieval"})
+        self.assertGreater(statistics["increment"]["=retrieval"][1], 0)
+        self.assertTrue(all(tested >= failed for rule in statistics.values() for tested, failed in rule.values()))
+
+class TestSelectionCache(unittest.TestCase):
+    """
+    Testing that cached rule selections agree with rule selections.
+    """
+
+    def run_model(self, **model_parameters):
+        counting = modeltests.Counting_stringversion()
+        counting.model.model_parameters.update(model_parameters)
+        sim = counting.model.simulation(trace=False)
+        events = []
+        while True:
+            sim.step()
+            events.append(sim.current_event)
+            if sim.current_event.action == "NO RULE FOUND" and sim.current_event.time > 0.25:
+                break
+        return counting.model, events
+
+    def test_procedure(self):
+        model, events = self.run_model(selection_cache=10)
+        self.assertEqual(events, self.run_model()[1])
+        info = model.selection_cache_info()
+        self.assertEqual(info["hits"] + info["misses"], len([event for event in events if event.action == "CONFLICT RESOLUTION"]))
+        self.assertEqual(info["misses"], info["size"])
+
+    def test_hits(self):
+        model = self.run_model(selection_cache=10)[0]
+        pr = model.used_productions
+        hits = model.selection_cache_info()["hits"]
+        self.assertEqual(pr.selection(), None)
+        self.assertEqual(model.selection_cache_info()["hits"], hits + 1)
+        pr.rules["stop"]["utility"] = 1
+        pr.selection()
+        self.assertEqual(model.selection_cache_info()["size"], 1)
+
 class TestCountModelstring(unittest.TestCase):
     """
     Testing Count model, the simplest model in Lisp ACT-R (the string version).
@@ -1114,6 +1704,189 @@ class TestBaseLevelLearningModel(unittest.TestCase):
         cleared_time2 = self.sim.show_time()
         np.testing.assert_array_equal(np.array([cleared_time, keypressing_time]), self.sim._Simulation__pr.dm['retrieval'][chunks.Chunk("pair", probe="bank", answer="0")]) #keypressing_time relevant because at that point retrieval is cleared
 
+class TestScheduler(unittest.TestCase):
+    """
+    Testing that the native scheduler produces the same trace as simpy.
+    """
+
+    def trace(self, build, scheduler, max_time=20):
+        np.random.seed(10)
+        sim = build(scheduler)
+        events = []
+        while sim.show_time() < max_time:
+            try:
+                sim.step()
+            except simpy.core.EmptySchedule:
+                break
+            events.append(tuple(sim.current_event[0:3]))
+        return events
+
+    def compare(self, build, max_time=20):
+        warnings.simplefilter("ignore")
+        simpy_trace = self.trace(build, "simpy", max_time)
+        self.assertTrue(simpy_trace)
+        self.assertEqual(simpy_trace, self.trace(build, "native", max_time))
+
+    def test_counting(self):
+        def build(scheduler):
+            counting = modeltests.Counting_stringversion()
+            return counting.model.simulation(trace=False, scheduler=scheduler)
+        self.compare(build)
+
+    def test_addition(self):
+        self.compare(lambda scheduler: modeltests.Addition().model.simulation(trace=False, scheduler=scheduler))
+
+    def test_motor(self):
+        def build(scheduler):
+            mm = modeltests.MotorModel()
+            mm.model.productions(mm.start, mm.go_on, mm.finish)
+            return mm.model.simulation(trace=False, scheduler=scheduler)
+        self.compare(build)
+
+    def test_utilities(self):
+        def build(scheduler):
+            mm = modeltests.Utilities(subsymbolic=True, utility_noise=10, utility_learning=True)
+            mm.m.productions(mm.one, mm.two, mm.three)
+            return mm.m.simulation(trace=False, scheduler=scheduler)
+        self.compare(build)
+
+    def test_compilation(self):
+        self.compare(lambda scheduler: modeltests.Compilation6(production_compilation=True, strict_harvesting=True).m.simulation(trace=False, scheduler=scheduler))
+
+    def test_environment(self):
+        def build(scheduler):
+            text = [{1: {'text': 'bank', 'position': (1366, 0)}}, {1: {'text': '0', 'position': (1366, 0)}}]
+            environ = actr.Environment(size=(1366,768), focus_position=(0,0))
+            m = modeltests.Paired(environ, subsymbolic=True, baselevel_learning=True, latency_factor=0.4, decay=0.5, retrieval_threshold=-2, instantaneous_noise=0, strict_harvesting=True, emma_noise=False, automatic_visual_search=False, eye_mvt_angle_parameter=1, eye_mvt_scaling_parameter=0.05)
+            return m.m.simulation(trace=False, gui=False, environment_process=environ.environment_process, stimuli=2*text, triggers=4*["0"], times=5, start_time=0, scheduler=scheduler)
+        self.compare(build, 20)
+
+    def test_unknown(self):
+        counting = modeltests.Counting()
+        self.assertRaises(util.ACTRError, counting.model.simulation, trace=False, scheduler="unknown")
+
+    def test_schedule_triggered(self):
+        for name, environments in actr.simulation.Simulation._SCHEDULERS.items():
+            env = environments[0]()
+            processed = []
+            def record(event):
+                processed.append((env.now, event.value))
+            late = env.schedule_triggered(env.event(), 2, value="late")
+            env.timeout(0, "normal").callbacks.append(record)
+            late.callbacks.append(record)
+            env.schedule_triggered(env.event(), 0, value="urgent").callbacks.append(record)
+            env.schedule_triggered(env.event(), 1, delay=1, value="delayed").callbacks.append(record)
+            self.assertTrue(late.triggered)
+            self.assertRaises(RuntimeError, env.schedule_triggered, late, 2)
+            env.run()
+            self.assertEqual(processed, [(0, "urgent"), (0, "normal"), (0, "late"), (1, "delayed")], name)
+
+class TestRunUntil(unittest.TestCase):
+    """
+    Testing run_until and collect, on MotorModel and Count model.
+    """
+
+    def setUp(self):
+        warnings.simplefilter("ignore")
+        mm = modeltests.MotorModel()
+        mm.model.productions(mm.start, mm.go_on, mm.finish)
+        self.sim = mm.model.simulation(trace=False)
+
+    def test_run_until(self):
+        self.assertEqual(self.sim.run_until("KEY PRESSED: B"), 0.5)
+        self.assertEqual(self.sim.current_event.action, "KEY PRESSED: B")
+        self.assertEqual(self.sim.run_until(lambda event: event.proc == "manual" and event.action == "KEY PRESSED: C"), 0.8)
+        self.assertEqual(self.sim.show_time(), 0.8)
+
+    def test_step(self):
+        sim = modeltests.Counting_stringversion().model.simulation(trace=False)
+        stepped = modeltests.Counting_stringversion().model.simulation(trace=False)
+        events = []
+        while True:
+            stepped.step()
+            events.append(stepped.current_event)
+            if stepped.current_event.action == "RETRIEVED: countOrder(first= 2, second= 3)":
+                break
+        stepped.step()
+        self.assertEqual(sim.run_until("RETRIEVED"), events[-1].time)
+        self.assertEqual(sim.current_event, events[-1])
+        sim.step()
+        self.assertNotEqual(sim.current_event, events[-1])
+        self.assertEqual(sim.current_event, stepped.current_event)
+        sim.collect([], max_time=0.2)
+        last = sim.current_event
+        sim.step()
+        self.assertNotEqual(sim.current_event, last)
+
+    def test_max_time(self):
+        self.assertEqual(self.sim.run_until("KEY PRESSED: B", max_time=0.3), None)
+        self.assertLess(self.sim.show_time(), 0.3)
+        self.assertEqual(self.sim.run_until("KEY PRESSED: B", max_time=1), 0.5)
+        self.assertEqual(self.sim.run_until("KEY PRESSED: X"), None)
+        self.assertRaises(util.ACTRError, self.sim.run_until, 1)
+
+    def test_collect(self):
+        def stepped(scheduler):
+            sim = modeltests.Counting_stringversion().model.simulation(trace=False, scheduler=scheduler)
+            collected = {"RULE FIRED": [], "RETRIEVED": []}
+            while True:
+                try:
+                    sim.step()
+                except simpy.core.EmptySchedule:
+                    break
+                for pattern in collected:
+                    if re.search("^" + pattern, sim.current_event.action):
+                        collected[pattern].append(sim.current_event.time)
+            return collected
+        for scheduler in ("simpy", "native"):
+            sim = modeltests.Counting_stringversion().model.simulation(trace=False, scheduler=scheduler)
+            collected = sim.collect(["RULE FIRED", "RETRIEVED"])
+            self.assertEqual(len(collected["RULE FIRED"]), 4)
+            self.assertEqual(collected, stepped(scheduler))
+
+class TestEvents(unittest.TestCase):
+    """
+    Testing events with action codes and lazily rendered descriptions.
+    """
+
+    class Payload(object):
+
+        def __init__(self):
+            self.rendered = 0
+
+        def __str__(self):
+            self.rendered += 1
+            return "chunk"
+
+    def test_lazy(self):
+        payload = self.Payload()
+        event = util.Event(0.05, "retrieval", util.RETRIEVED, (payload,))
+        self.assertTrue(event.startswith("RETRIEVED"))
+        self.assertFalse(event.startswith("KEY"))
+        self.assertEqual(payload.rendered, 0)
+        self.assertEqual(event.action, "RETRIEVED: chunk")
+        self.assertEqual(event.action, "RETRIEVED: chunk")
+        self.assertEqual(payload.rendered, 1)
+        self.assertTrue(event.startswith("RETRIEVED: ch"))
+
+    def test_compatibility(self):
+        event = util.Event(0.05, "retrieval", util.RETRIEVED, ("chunk",))
+        self.assertEqual(event[0:3], (0.05, "retrieval", "RETRIEVED: chunk"))
+        self.assertEqual(event, (0.05, "retrieval", "RETRIEVED: chunk"))
+        self.assertEqual(event, util.Event(0.05, "retrieval", "RETRIEVED: chunk"))
+        self.assertNotEqual(event, util.Event(0.1, "retrieval", "RETRIEVED: chunk"))
+        self.assertEqual(tuple(event), (0.05, "retrieval", "RETRIEVED: chunk"))
+        self.assertEqual(event.action[0:9], "RETRIEVED")
+        self.assertEqual(util.Event(0, "g", "CLEARED").action, "CLEARED")
+
+    def test_simulation(self):
+        warnings.simplefilter("ignore")
+        sim = modeltests.Counting_stringversion().model.simulation(trace=False)
+        self.assertEqual(sim.run_until(util.RETRIEVED), 0.1)
+        self.assertIs(sim.current_event.code, util.RETRIEVED)
+        self.assertEqual(sim.current_event.action, "RETRIEVED: countOrder(first= 2, second= 3)")
+        self.assertEqual(sim.collect([util.RULE_FIRED])[util.RULE_FIRED], [0.15, 0.25, 0.3])
+
 class TestSourceActivation(unittest.TestCase):
     """
     Testing source activation.
@@ -1222,6 +1995,31 @@ class TestSourceActivation3(unittest.TestCase):
         self.dm.add(self.ch4)
         self.assertEqual(round(util.spreading_activation(self.ch4, self.buffers, self.dm, {"g2": 1}, 2), 6), 1.083709)
 
+    def test_fan(self):
+        bush = chunks.makechunk("", "pres", pres="bush")
+        self.assertEqual(self.dm.unrestricted_number_chunks[bush], 2)
+        self.assertEqual(self.dm.restricted_number_chunks[("x", bush)], 1)
+        self.assertEqual(self.dm.restricted_number_chunks[("z", bush)], 1)
+        self.assertEqual(round(util.spreading_activation(self.ch2, self.buffers, self.dm, {"g2": 1}, 2), 6), 0.901388)
+        del self.dm[self.ch3]
+        self.assertEqual(self.dm.unrestricted_number_chunks[bush], 1)
+        self.assertNotIn(("z", bush), self.dm.restricted_number_chunks)
+        self.assertEqual(round(util.spreading_activation(self.ch2, self.buffers, self.dm, {"g2": 1}, 2), 6), round(2 - math.log(2), 6))
+        self.assertEqual(round(util.spreading_activation(self.ch2, self.buffers, self.dm, {"g2": 1}, 2, restricted=True), 6), 0)
+        self.dm.add(self.ch3)
+        self.assertEqual(round(util.spreading_activation(self.ch2, self.buffers, self.dm, {"g2": 1}, 2), 6), 0.901388)
+
+    def test_batch(self):
+        self.dm.add(chunks.makechunk("","three", x=chunks.makechunk("","pres", pres="bush"), xx=chunks.makechunk("","pres", pres="bush")))
+        self.dm.add(chunks.makechunk("","pres", pres="bush"))
+        elements = list(self.dm)
+        for spreading in [{"g": 1}, {"g2": 1}, {"g3": 1}, {"g2": 1, "g3": 2, "g4": 0.5}]:
+            for restricted in [False, True]:
+                sources = util.spreading_sources(self.buffers, spreading)
+                batch = self.dm.spreading_activation(elements, sources, 2, restricted)
+                for idx, chunk in enumerate(elements):
+                    self.assertEqual(batch[idx], util.spreading_activation(chunk, self.buffers, self.dm, spreading, 2, restricted))
+
 class TestSourceActivation4(unittest.TestCase):
     """
     Testing strength association using chunkstring.
@@ -1316,6 +2114,31 @@ class TestSourceActivation6(unittest.TestCase):
         self.dm.add(self.ch4)
         self.assertEqual(round(util.spreading_activation(self.ch4, self.buffers, self.dm, {"g2": 1}, 2), 6), 1.083709)
 
+    def test_fan(self):
+        bush = chunks.makechunk("", "pres", pres="bush")
+        self.assertEqual(self.dm.unrestricted_number_chunks[bush], 2)
+        self.assertEqual(self.dm.restricted_number_chunks[("x", bush)], 1)
+        self.assertEqual(self.dm.restricted_number_chunks[("z", bush)], 1)
+        self.assertEqual(round(util.spreading_activation(self.ch2, self.buffers, self.dm, {"g2": 1}, 2), 6), 0.901388)
+        del self.dm[self.ch3]
+        self.assertEqual(self.dm.unrestricted_number_chunks[bush], 1)
+        self.assertNotIn(("z", bush), self.dm.restricted_number_chunks)
+        self.assertEqual(round(util.spreading_activation(self.ch2, self.buffers, self.dm, {"g2": 1}, 2), 6), round(2 - math.log(2), 6))
+        self.assertEqual(round(util.spreading_activation(self.ch2, self.buffers, self.dm, {"g2": 1}, 2, restricted=True), 6), 0)
+        self.dm.add(self.ch3)
+        self.assertEqual(round(util.spreading_activation(self.ch2, self.buffers, self.dm, {"g2": 1}, 2), 6), 0.901388)
+
+    def test_batch(self):
+        self.dm.add(chunks.makechunk("","three", x=chunks.makechunk("","pres", pres="bush"), xx=chunks.makechunk("","pres", pres="bush")))
+        self.dm.add(chunks.makechunk("","pres", pres="bush"))
+        elements = list(self.dm)
+        for spreading in [{"g": 1}, {"g2": 1}, {"g3": 1}, {"g2": 1, "g3": 2, "g4": 0.5}]:
+            for restricted in [False, True]:
+                sources = util.spreading_sources(self.buffers, spreading)
+                batch = self.dm.spreading_activation(elements, sources, 2, restricted)
+                for idx, chunk in enumerate(elements):
+                    self.assertEqual(batch[idx], util.spreading_activation(chunk, self.buffers, self.dm, spreading, 2, restricted))
+
 
 class TestProductionUtilities(unittest.TestCase):
     """
@@ -1367,6 +2190,40 @@ class TestProductionUtilities(unittest.TestCase):
 
         self.assertEqual(self.test._ACTRModel__productions["three"]["utility"], 1.99)
 
+class TestRuleFirings(unittest.TestCase):
+    """
+    Testing incremental utility learning.
+    """
+
+    def setUp(self):
+        self.times = {"one": [0.05, 0.3, 0.35, 1.2], "two": [0.1, 2.5]}
+
+    def utilities(self, rulenames):
+        rules = productions.Productions()
+        for rulename in self.times:
+            rules.update({rulename: {"rule": None, "utility": 2, "reward": None}})
+        util.modify_utilities(3, 10, rulenames, rules, {"utility_alpha": 0.2})
+        return {rulename: rules[rulename]["utility"] for rulename in rules}
+
+    def test_reward(self):
+        expected = {}
+        for rulename, times in self.times.items():
+            utility = 2
+            for t in times:
+                utility = utility + 0.2*(10-(3-t)-utility)
+            expected[rulename] = round(utility, 4)
+        firings = util.RuleFirings(0.2, firings=self.times)
+        self.assertEqual(firings.count("one"), 4)
+        self.assertEqual(self.utilities(firings), expected)
+        for rulename, utility in self.utilities(self.times).items():
+            self.assertAlmostEqual(utility, expected[rulename], 3)
+
+    def test_horizon(self):
+        firings = util.RuleFirings(0.2, horizon=2, firings=self.times)
+        self.assertEqual(firings.count("one"), 4)
+        self.assertEqual(self.utilities(firings), self.utilities({"one": [1.2], "two": [2.5]}))
+        self.assertEqual(firings.count("one"), 1)
+
 class TestCompilation1(unittest.TestCase):
     """
     Testing production compilation.
@@ -1857,6 +2714,35 @@ class TestCompilation11(unittest.TestCase):
         self.model._ACTRModel__productions.pop("two and one")
         self.assertEqual(new_rule["utility"], u2)
 
+class TestCompilationCaches(unittest.TestCase):
+    """
+    Testing that unsafe compilations are remembered and compiled rules are found by their structure.
+    """
+
+    def test_rejected(self):
+        mm = modeltests.Compilation9(production_compilation=True)
+        sim = mm.m.simulation(trace=False)
+        while True:
+            try:
+                sim.step()
+            except simpy.core.EmptySchedule:
+                break
+        rejected = mm.m._ACTRModel__productions._Productions__rejected
+        self.assertEqual({(x[0], x[2]) for x in rejected}, {("one", "two")})
+
+    def test_structure(self):
+        mm = modeltests.Compilation11(utility_learning=True, production_compilation=True)
+        sim = mm.m.simulation(trace=False)
+        while True:
+            sim.step()
+            if sim.current_event.action == "RULE RE-CREATED: one and two":
+                break
+        rules = mm.m._ACTRModel__productions
+        structure = rules.structure(rules["one and two"])
+        self.assertIsNotNone(structure)
+        self.assertEqual(rules._Productions__structures[("one", "two", structure)], "one and two")
+        self.assertNotEqual(structure, rules.structure(rules["one"]))
+
 class TestCompilation12(unittest.TestCase):
     """
     Testing production compilation.
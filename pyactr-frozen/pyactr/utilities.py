@@ -3,6 +3,7 @@ Helper functions used by ACT-R modules.
 """
 
 import collections
+import functools
 import re
 import math
 import random
@@ -89,7 +90,108 @@ VISIONONEWAYCLOSEST = "onewayclosest" # onewayclosest is closest in one directio
 
 #for Events
 
-Event = collections.namedtuple('Event', 'time proc action')
+class Action(object):
+    """
+    Kind of action carried by events, e.g., RETRIEVED. The description of the action is rendered from template and the payload of the event only when it is needed (when trace is printed or event.action is read).
+    """
+
+    __slots__ = ("name", "template", "prefix")
+
+    def __init__(self, name, template):
+        self.name = name
+        self.template = template
+        self.prefix = template.split("%", 1)[0] #literal part of the description, known without rendering
+
+    def render(self, payload):
+        """
+        Returns the description of the action for payload (a tuple of arguments for template).
+        """
+        return self.template % payload
+
+    def __repr__(self):
+        return self.name
+
+RULE_SELECTED = Action("RULE_SELECTED", "RULE SELECTED: %s")
+RULE_STOPPED = Action("RULE_STOPPED", "RULE STOPPED FROM FIRING: %s")
+RULE_COMPILED = Action("RULE_COMPILED", "RULE %s: %s")
+RULE_FIRED = Action("RULE_FIRED", "RULE FIRED: %s")
+WROTE_CHUNK = Action("WROTE_CHUNK", "WROTE A CHUNK: %s")
+CREATED_CHUNK = Action("CREATED_CHUNK", "CREATED A CHUNK: %s")
+RETRIEVED = Action("RETRIEVED", "RETRIEVED: %s")
+ENCODED_VIS_OBJECT = Action("ENCODED_VIS_OBJECT", "ENCODED VIS OBJECT:'%s'")
+ENCODED_LOCATION = Action("ENCODED_LOCATION", "ENCODED LOCATION: %s")
+ENCODED_LOCATION_QUOTED = Action("ENCODED_LOCATION_QUOTED", "ENCODED LOCATION:'%s'")
+AUTOMATIC_BUFFERING = Action("AUTOMATIC_BUFFERING", "AUTOMATIC BUFFERING: %s")
+SHIFT_COMPLETE = Action("SHIFT_COMPLETE", "SHIFT COMPLETE TO POSITION: %s")
+COMMAND = Action("COMMAND", "COMMAND: %s")
+KEY_PRESSED = Action("KEY_PRESSED", "KEY PRESSED: %s")
+
+class Event(object):
+    """
+    Event in simulation: time, proc (module) and action. Action is either a string or an Action code; in the latter case, payload carries the arguments of the description, which is rendered when event.action is read.
+
+    Event behaves like the tuple (time, proc, action).
+    """
+
+    __slots__ = ("time", "proc", "code", "payload", "__action")
+
+    def __init__(self, time, proc, action, payload=()):
+        self.time = time
+        self.proc = proc
+        self.code = action
+        self.payload = payload
+        self.__action = None
+
+    @property
+    def action(self):
+        """
+        Description of the action, rendered (once) from code and payload.
+        """
+        if self.__action is None:
+            if isinstance(self.code, Action):
+                self.__action = self.code.render(self.payload)
+            else:
+                self.__action = self.code
+        return self.__action
+
+    def startswith(self, prefix):
+        """
+        Checks whether the action starts with prefix. The description is rendered only when its literal part does not decide it.
+        """
+        code = self.code
+        if isinstance(code, Action) and len(prefix) <= len(code.prefix):
+            return code.prefix.startswith(prefix)
+        return self.action.startswith(prefix)
+
+    def __iter__(self):
+        return iter((self.time, self.proc, self.action))
+
+    def __len__(self):
+        return 3
+
+    def __getitem__(self, index):
+        return (self.time, self.proc, self.action)[index]
+
+    def __eq__(self, other):
+        if isinstance(other, Event):
+            if self.code is other.code and self.payload is other.payload:
+                return self.time == other.time and self.proc == other.proc
+            return self.time == other.time and self.proc == other.proc and self.action == other.action
+        elif isinstance(other, tuple):
+            return tuple(self) == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return "Event(time=%r, proc=%r, action=%r)" % tuple(self)
 
 #for rules
 
@@ -158,9 +260,10 @@ def get_similarity(d, val1, val2, mismatch_penalty=1):
     dis = d.get(tuple((val2, val1)), -mismatch_penalty) #-1 is the default value
     return dis
 
+@functools.lru_cache(maxsize=None)
 def getchunk():
     """
-    Using pyparsing, create chunk reader for chunk strings.
+    Using pyparsing, create chunk reader for chunk strings. The reader is created only once and then shared.
     """
     slot = pp.Word("".join([pp.alphas, "_"]), "".join([pp.alphanums, "_"]))
     special_value = pp.Group(pp.oneOf([ACTRVARIABLE, "".join([ACTRNEG, ACTRVARIABLE]), ACTRNEG, VISIONGREATER, VISIONSMALLER, "".join([VISIONGREATER, ACTRVARIABLE]), "".join([VISIONSMALLER, ACTRVARIABLE])])\
@@ -172,6 +275,13 @@ def getchunk():
     chunk_reader = pp.OneOrMore(pp.Group(slot + value))
     return chunk_reader
 
+@functools.lru_cache(maxsize=4096)
+def parsechunk(string):
+    """
+    Parse chunk string, using getchunk. Parsed strings are cached, so the result is shared and must not be changed.
+    """
+    return getchunk().parseString(string, parseAll=True)
+
 def make_chunkparts_without_varconflicts(chunkpart, rule_name, variables):
     """
     Make a chunk avoiding any variable names used in actrvariables. The function uses rule_name for naming, if possible.
@@ -246,9 +356,10 @@ def merge_chunkparts(chunkpart1, chunkpart2):
 
 #############utilities for rules######################################
 
+@functools.lru_cache(maxsize=None)
 def getrule():
     """
-    Using pyparsing, get rule out of a string.
+    Using pyparsing, get rule out of a string. The reader is created only once and then shared.
     """
     arrow = pp.Literal("==>")
     buff = pp.Word(pp.alphas, "".join([pp.alphanums, "_"]))
@@ -259,6 +370,13 @@ def getrule():
     rule_reader = pp.Group(pp.OneOrMore(pp.Group(special_valueLHS + buff + end_buffer + pp.Group(pp.Optional(chunk))))) + arrow + pp.Group(pp.OneOrMore(pp.Group(special_valueRHS + buff + end_buffer + pp.Group(pp.Optional(chunk)))))
     return rule_reader
 
+@functools.lru_cache(maxsize=4096)
+def parserule(string):
+    """
+    Parse rule string, using getrule. Parsed strings are cached, so the result is shared and must not be changed.
+    """
+    return getrule().parseString(string, parseAll=True)
+
 def check_bound_vars(actrvariables, elem, negative_impossible=True):
     """
     Check that elem is a bound variable, or not a variable. If the test goes through, return elem.
@@ -400,10 +518,84 @@ def match(dict2, slotvals, name1, name2):
             
 
 
+class RuleFirings(object):
+    """
+    Firings of rules since the last reward, used in utility learning.
+
+    Utility learning updates U = U + alpha*(reward-(time-t)-U) for every firing at t. Carried out for n firings, this gives U = (1-alpha)^n*U + (1-(1-alpha)^n)*(reward-time) + alpha*sum((1-alpha)^(n-j)*t_j). Only n and the discounted sum of firing times are stored per rule, so memory per rule is constant and rewards take time proportional to the number of rules fired since the last reward.
+
+    If horizon is given, firings that happened more than horizon seconds before a reward are dropped. Firing times in the horizon have to be stored in that case.
+    """
+
+    def __init__(self, alpha, horizon=None, firings=None):
+        self.alpha = alpha
+        self.horizon = horizon
+        self.__firings = {} #rulename -> [number of firings, discounted sum of firing times, firing times in horizon or None]
+        if firings:
+            for rulename in firings:
+                for time in firings[rulename]:
+                    self.add(rulename, time)
+
+    def __iter__(self):
+        return iter(self.__firings)
+
+    def __len__(self):
+        return len(self.__firings)
+
+    def __contains__(self, rulename):
+        return rulename in self.__firings
+
+    def count(self, rulename):
+        """
+        Number of firings of rulename since the last reward.
+        """
+        return self.__firings[rulename][0] if rulename in self.__firings else 0
+
+    def clear(self):
+        """
+        Forget all firings.
+        """
+        self.__firings = {}
+
+    def add(self, rulename, time):
+        """
+        Add a firing of rulename at time.
+        """
+        firings = self.__firings.setdefault(rulename, [0, 0, None if self.horizon is None else collections.deque()])
+        firings[0] += 1
+        firings[1] = (1-self.alpha)*firings[1] + time
+        if firings[2] is not None:
+            firings[2].append(time)
+            self.__drop(firings, time)
+
+    def __drop(self, firings, time):
+        """
+        Drop firings older than horizon.
+        """
+        times = firings[2]
+        while times and time - times[0] > self.horizon:
+            firings[1] -= (1-self.alpha)**(firings[0]-1) * times.popleft()
+            firings[0] -= 1
+
+    def reward(self, time, reward, rules):
+        """
+        Update utilities of rules given reward at time.
+        """
+        for rulename, firings in self.__firings.items():
+            if firings[2] is not None:
+                self.__drop(firings, time)
+            if not firings[0]:
+                continue
+            decay = (1-self.alpha)**firings[0]
+            rules[rulename]["utility"] = round(decay*rules[rulename]["utility"] + (1-decay)*(reward-time) + self.alpha*firings[1], 4)
+
 def modify_utilities(time, reward, rulenames, rules, model_parameters):
     """
-    Update rules with newly calculated utilities for rules whose firing led to reward.
+    Update rules with newly calculated utilities for rules whose firing led to reward. rulenames are RuleFirings, or a dict of rulenames and lists of their firing times.
     """
+    if isinstance(rulenames, RuleFirings):
+        rulenames.reward(time, reward, rules)
+        return
     for rulename in rulenames:
         for t in rulenames[rulename]:
             utility_time = time-t
@@ -421,9 +613,19 @@ def calculate_setting_time(updated):
 
 #############utilities for baselevel learning and noise######################################
 
-def baselevel_learning(current_time, times, bll, decay, activation=None, optimized_learning=False):
+def hybrid_window(optimized_learning):
+    """
+    Number of the most recent presentations calculated exactly in hybrid optimized learning, or None if optimized_learning is not hybrid. False, True and 1 (which stands for True) are not hybrid, integers k > 1 are.
+    """
+    if isinstance(optimized_learning, (bool, np.bool_)) or not optimized_learning or int(optimized_learning) != optimized_learning or optimized_learning <= 1:
+        return None
+    return int(optimized_learning)
+
+def baselevel_learning(current_time, times, bll, decay, activation=None, optimized_learning=False, dropped=None):
     """
     Calculate base-level learning: B_i = ln(sum(t_j^{-decay})) for t_j = current_time - t for t in times.
+
+    optimized_learning can be False (exact calculation), True or 1 (the closed form of optimized learning) or an integer k > 1 (hybrid optimized learning, see hybrid_learning). dropped is a pair (number of presentations, time of the first presentation) summarizing presentations that are no longer stored in times; it is only used by hybrid optimized learning.
     """
     if len(times) > 0:
         with warnings.catch_warnings(record=True):
@@ -436,7 +638,7 @@ def baselevel_learning(current_time, times, bll, decay, activation=None, optimiz
                     temp_times = np.delete(times, times.argmax())
                     if len(temp_times) > 0:
                         B = math.log(np.sum((current_time - temp_times) ** (-decay)))
-            elif bll:
+            elif bll and not hybrid_window(optimized_learning):
                 try:
                     B = math.log(len(times)/(1-decay)) - decay*math.log(current_time - np.max(times)) #calculating bll using optimized learning -- much faster since it's a single calculation
                 #this part removes chunk storages that are stored at current time (blocking simultaneous retrieval)
@@ -444,6 +646,14 @@ def baselevel_learning(current_time, times, bll, decay, activation=None, optimiz
                     temp_times = np.delete(times, times.argmax())
                     if len(temp_times) > 0:
                         B = math.log(len(times)/(1-decay)) - decay*math.log(current_time - np.max(temp_times)) #calculating bll using optimized learning -- much faster since it's a single calculation
+            elif bll:
+                try:
+                    B = math.log(hybrid_learning(current_time, times, decay, hybrid_window(optimized_learning), dropped))
+                #this part removes chunk storages that are stored at current time (blocking simultaneous retrieval)
+                except RuntimeWarning:
+                    temp_times = np.delete(times, times.argmax())
+                    if len(temp_times) > 0:
+                        B = math.log(hybrid_learning(current_time, temp_times, decay, hybrid_window(optimized_learning), dropped))
 
     #add hard-coded activation
     if activation != None:
@@ -453,15 +663,102 @@ def baselevel_learning(current_time, times, bll, decay, activation=None, optimiz
             B = activation
     return B
 
-def calculate_instantaneous_noise(instantaneous_noise):
+def hybrid_learning(current_time, times, decay, k, dropped=None):
+    """
+    Calculate sum(t_j^{-decay}) using hybrid optimized learning (Petrov, 2006): the k most recent presentations are summed exactly, the n-k older ones are approximated as if they were spread evenly between the first presentation (age t_n) and the k-th most recent one (age t_k):
+
+    (n-k)(t_n^{1-decay}-t_k^{1-decay})/((1-decay)(t_n-t_k))
+
+    dropped is a pair (number of presentations, time of the first presentation) for presentations not present in times.
+
+    The approximation is exact when k covers all presentations, and it is close when the older presentations are evenly spaced. Otherwise, the error depends on how the older presentations are spread. For presentations drawn uniformly at random, the error in B was at most 0.2 for k=1 and 0.06 for k=10 with 50 presentations, and at most 0.02 for k=1 and 0.01 for k=10 with 27000 presentations (decay 0.5).
+    """
+    times = np.sort(times)
+    recent = times[-k:]
+    count = len(times) - len(recent)
+    first = times[0]
+    if dropped is not None and dropped[0]:
+        count += dropped[0]
+        first = min(first, dropped[1])
+    total = np.sum((current_time - recent) ** (-decay))
+    if count:
+        age_n, age_k = current_time - first, current_time - recent[0]
+        if age_n == age_k:
+            total += count * age_k ** (-decay)
+        else:
+            total += count * (age_n ** (1-decay) - age_k ** (1-decay)) / ((1-decay) * (age_n - age_k))
+    return total
+
+def baselevel_learning_batch(current_time, times, offsets, bll, decay, activations=None, optimized_learning=False, dropped=None):
+    """
+    Calculate base-level learning for several chunks at once.
+
+    times stores presentation times of all chunks in one array; chunk i has times[offsets[i]:offsets[i+1]] (the last chunk runs to the end of times). activations lists hard-coded activations (or None) per chunk. dropped is a pair of arrays (numbers of presentations, times of first presentations) summarizing presentations no longer stored in times, used by hybrid optimized learning (see baselevel_learning).
+
+    Return an array of activations and a boolean array stating for which chunks activation is defined (it is not defined for chunks with no presentation and no hard-coded activation). Chunks with a presentation at or after current_time are passed to baselevel_learning, so they are treated exactly as there.
+    """
+    offsets = np.asarray(offsets, dtype=int)
+    B = np.full(len(offsets), np.nan)
+    defined = np.zeros(len(offsets), dtype=bool)
+    activations = [None] * len(offsets) if activations is None else list(activations)
+    lengths = np.diff(np.append(offsets, len(times)))
+    nonempty = np.flatnonzero(lengths > 0)
+    hybrid = hybrid_window(optimized_learning)
+    if hybrid:
+        counts, firsts = (np.zeros(len(offsets), dtype=int), np.full(len(offsets), np.inf)) if dropped is None else (np.asarray(dropped[0]), np.asarray(dropped[1], dtype=float))
+    if bll and len(nonempty) > 0:
+        starts = offsets[nonempty]
+        with np.errstate(all='ignore'):
+            if hybrid:
+                rows = np.repeat(np.arange(len(offsets)), lengths)
+                times = times[np.lexsort((times, rows))] #times of every chunk in ascending order
+            elapsed = current_time - times
+            if hybrid:
+                ends = starts + lengths[nonempty]
+                cuts = np.maximum(ends - hybrid, starts) #the oldest of the k most recent presentations
+                recent = np.arange(len(times)) >= np.repeat(cuts, lengths[nonempty])
+                count = counts[nonempty] + cuts - starts
+                age_n = current_time - np.minimum(np.where(counts[nonempty] > 0, firsts[nonempty], np.inf), times[starts])
+                age_k = elapsed[cuts]
+                older = count * np.where(age_n == age_k, age_k ** (-decay), (age_n ** (1-decay) - age_k ** (1-decay)) / ((1-decay) * (age_n - age_k)))
+                values = np.log(np.add.reduceat(np.where(recent, elapsed ** (-decay), 0), starts) + np.where(count > 0, older, 0))
+            elif optimized_learning:
+                values = np.log(lengths[nonempty]/(1-decay)) - decay*np.log(current_time - np.maximum.reduceat(times, starts))
+            else:
+                values = np.log(np.add.reduceat(elapsed ** (-decay), starts))
+        regular = np.logical_and.reduceat(elapsed > 0, starts) & np.isfinite(values)
+        B[nonempty[regular]] = values[regular]
+        defined[nonempty[regular]] = True
+        for idx in nonempty[~regular]:
+            try:
+                B[idx] = baselevel_learning(current_time, times[offsets[idx]:offsets[idx]+lengths[idx]], bll, decay, activations[idx], optimized_learning, (counts[idx], firsts[idx]) if hybrid else None)
+            except UnboundLocalError:
+                pass
+            else:
+                defined[idx] = True
+                activations[idx] = None #already included
+    for idx, activation in enumerate(activations):
+        if activation != None:
+            if defined[idx]:
+                B[idx] = math.log(math.exp(B[idx]) + math.exp(activation))
+            else:
+                B[idx] = activation
+                defined[idx] = True
+    return B, defined
+
+def calculate_instantaneous_noise(instantaneous_noise, size=None):
     """
     Calculate noise, generated by logistic distribution with mean 0 and variance = ( pi^2/3 ) * s^2 where s = instantaneous_noise.
+
+    If size is given, an array of size independent draws is returned (the same draws as size separate calls would give).
     """
     assert instantaneous_noise >= 0, "Instantaneous noise must be positive"
     if instantaneous_noise == 0:
-        return 0
-    else:
+        return 0 if size is None else np.zeros(size)
+    elif size is None:
         return np.random.logistic(0, instantaneous_noise, 1)[0]
+    else:
+        return np.random.logistic(0, instantaneous_noise, size)
 
 #############utilities for source activation######################################
 
@@ -510,27 +807,11 @@ def calculate_strength_association(chunk, otherchunk, dm, strength_of_associatio
     else:
         if restricted:
             if (restricted, chunk) in slotvalues:
-                if (restricted, chunk) not in dm.restricted_number_chunks:
-                    slots_j = 1
-                    for each in dm:
-                        for x in each:
-                            if x[0] == restricted and splitting(x[1]).values and chunk == splitting(x[1]).values:
-                                slots_j += 1
-                    dm.restricted_number_chunks.update({(restricted, chunk): slots_j})
-                else:
-                    slots_j = dm.restricted_number_chunks[(restricted, chunk)]
+                slots_j = 1 + dm.restricted_number_chunks[(restricted, chunk)]
             else:
                 return 0
         else:
-            slots_j = 1
-            if chunk not in dm.unrestricted_number_chunks:
-                for each in dm:
-                    for x in each:
-                        if splitting(x[1]).values and chunk == splitting(x[1]).values:
-                            slots_j += 1
-                dm.unrestricted_number_chunks.update({chunk: slots_j})
-            else:
-                slots_j = dm.unrestricted_number_chunks[chunk]
+            slots_j = 1 + dm.unrestricted_number_chunks[chunk]
     slots_ij = list(values).count(chunk)
     return strength_of_association - math.log(slots_j/max(1, slots_ij))
 
@@ -557,6 +838,19 @@ def spreading_activation(chunk, buffers, dm, buffer_spreading_activation, streng
         SA += w_kj*s_ji
     return SA
 
+def spreading_sources(buffers, buffer_spreading_activation, only_chunks=True):
+    """
+    Collect sources of spreading activation: for every buffer, its weight w_kj and the slot-value pairs of the chunk in the buffer.
+    """
+    sources = []
+    for each in buffer_spreading_activation:
+        try:
+            otherchunk = list(buffers[each])[0]
+        except IndexError:
+            continue
+        sources.append((weigh_buffer(otherchunk, buffer_spreading_activation[each], only_chunks), tuple(find_chunks(otherchunk, only_chunks).items())))
+    return sources
+
 ##########utilities for subsymbolic retrieval, general###########
 
 def retrieval_success(activation, threshold):
@@ -337,7 +337,7 @@ class Visual(buffers.Buffer):
         if actrvariables == None:
             actrvariables = {}
         try:
-            mod_attr_val = {x[0]: utilities.check_bound_vars(actrvariables, x[1]) for x in otherchunk.removeunused()}
+            mod_attr_val = chunks.Template.compile(otherchunk).fill(actrvariables)
         except ACTRError as arg:
             raise ACTRError("Shifting towards the chunk '%s' is impossible; %s" % (otherchunk, arg))
 
@@ -351,7 +351,7 @@ class Visual(buffers.Buffer):
             except (AttributeError, KeyError):
                 raise ACTRError("The chunk in the visual buffer is not defined correctly. It is not possible to move attention.")
 
-        new_chunk = chunks.Chunk(self._VISUAL, **mod_attr_val) #creates new chunk
+        new_chunk = chunks.Chunk.build(self._VISUAL, mod_attr_val) #creates new chunk
 
         if model_parameters['emma']:
             angle_distance = utilities.calculate_visual_angle(self.environment.current_focus, [float(new_chunk.screen_pos.values.screen_x.values), float(new_chunk.screen_pos.values.screen_y.values)], self.environment.size, self.environment.simulated_screen_size, self.environment.viewing_distance)